@@ -1,11 +1,27 @@
 import streamlit as st
 import requests
-import json
+import os
 import uuid
+import toml
 from datetime import datetime
 import time
-import sqlite3
+import threading
+import functools
 from pathlib import Path
+from typing import Callable
+
+from backend_monitor import Backend, BackendMonitor
+from jobs import JobManager
+from metrics import QueryTimer, memory_report, summarize, to_json_lines, to_prometheus
+from response_cache import ResponseCache
+from exports import EXPORT_FORMATS, MAX_STATIC_FILE_BYTES, ExportTooLargeError, export_path, export_result, purge_exports
+from results import decode_preview
+from http_client import RETRYABLE_STATUSES, SQL_QUERY_DEADLINE, TIMEOUTS, CancelToken, build_session
+from sse import SSEStreamError, stream_events
+from sse import loads as sse_loads
+from storage import ANONYMOUS_OWNER, BaseSessionStore, Message, open_session_store
+from maintenance import Archive, open_archive, rehydrate_session
+from warmup import WarmupScheduler
 
 # Page configuration
 st.set_page_config(
@@ -145,193 +161,577 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# API endpoints
-API_BASE_URL = "http://44.218.47.211:8000"
-SQL_QUERY_ENDPOINT = f"{API_BASE_URL}/sql-query"
-HEALTH_ENDPOINT = f"{API_BASE_URL}/health"
-CLEAR_SESSION_ENDPOINT = f"{API_BASE_URL}/clear-session"
-MODELS_ENDPOINT = f"{API_BASE_URL}/models"
+# API endpoints, relative to each backend node's base URL
+SQL_QUERY_PATH = "/sql-query"
+HEALTH_PATH = "/health"
+CLEAR_SESSION_PATH = "/clear-session"
+CANCEL_PATH = "/cancel"
+WARMUP_PATH = "/warm-up"
+MODELS_PATH = "/models"
+
+# Backend nodes, from the first of: BIPP_API_BASE_URLS (comma-separated) or
+# BIPP_API_BASE_URL, [backend] urls in st.secrets, [backend] urls in the TOML
+# file named by BIPP_BACKENDS_FILE. Queries are balanced across them.
+DEFAULT_API_BASE_URL = "http://44.218.47.211:8000"
 
 # Local storage
-STORAGE_DIR = Path("streamlit_storage")
+STORAGE_DIR = Path(os.environ.get("BIPP_STORAGE_DIR", "streamlit_storage"))
 STORAGE_DIR.mkdir(exist_ok=True)
 SESSIONS_DB = STORAGE_DIR / "sessions.db"
+# Sessions are kept in SESSIONS_DB unless BIPP_DATABASE_URL (or [storage]
+# url in st.secrets) names a PostgreSQL database, which replicas behind a
+# load balancer need in order to share history. Jobs are tagged with
+# BIPP_REPLICA_ID (default: host name and process id) so a restarting
+# replica only fails its own; set it to a stable name per replica for its
+# jobs to be failed as soon as it restarts.
+REPLICA_ID = os.environ.get("BIPP_REPLICA_ID")
+# Sessions are scoped to the user named by the request header in
+# BIPP_USER_HEADER (set by an authenticating proxy), else to the signed-in
+# st.user when Streamlit authentication ([auth] in st.secrets) is configured,
+# else to one shared anonymous owner. With a header configured, requests
+# without it are refused; with [auth], visitors must sign in first.
+USER_HEADER = os.environ.get("BIPP_USER_HEADER")
+# Cold sessions moved out of the database by `python -m maintenance`; they
+# are restored when opened. With PostgreSQL the archives stay in the shared
+# database instead, so any replica can restore them.
+ARCHIVE_DIR = STORAGE_DIR / "archive"
+
+# Response cache for repeated questions. Bump BIPP_DATA_EPOCH after a data
+# refresh to invalidate every cached answer.
+RESPONSE_CACHE_ENABLED = os.environ.get("BIPP_RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_DB = STORAGE_DIR / "response_cache.db"
+RESPONSE_CACHE_TTL = int(os.environ.get("BIPP_RESPONSE_CACHE_TTL", 6 * 3600))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("BIPP_RESPONSE_CACHE_MAX_ENTRIES", 2000))
+DATA_EPOCH = os.environ.get("BIPP_DATA_EPOCH", "")
+
+# Health/model catalog refresh period for the shared backend monitor, and how
+# often an open page checks the monitor for status changes
+BACKEND_REFRESH_INTERVAL = 30
+STATUS_POLL_INTERVAL = 2
+
+# Background query workers per process
+QUERY_WORKERS = 8
+
+# A running query's progress is redrawn at most this many times per second
+RENDER_FPS = 4
+
+# The performance panel summarizes at most this many recent queries
+METRICS_WINDOW = 5000
+
+# Result tables show at most this many rows inline (st.dataframe scrolls them)
+RESULT_PREVIEW_ROWS = 10_000
+
+# Result exports are written here and served by Streamlit's static file
+# server (server.enableStaticServing), which streams them from disk
+EXPORT_DIR = Path(__file__).parent / "static" / "exports"
+EXPORT_URL_PREFIX = "app/static/exports"
+EXPORT_MAX_AGE = 3600
+
+# Sessions listed in the sidebar per page ("Mostrar mais" adds another page)
+SESSION_PAGE_SIZE = 20
+
+# Chat history is loaded and rendered in windows of this many messages
+MESSAGE_PAGE_SIZE = 30
+
+# At most this many messages are kept in a browser session's state. Past
+# that, the window is reset to the latest page (new messages) or the newest
+# messages are dropped (paging back); the rest is re-read from SQLite.
+MAX_MESSAGES_IN_MEMORY = 3 * MESSAGE_PAGE_SIZE
+
+# Comparison mode sends one prompt to at most this many models at once
+MAX_COMPARE_MODELS = 4
+
+# Opening a session or changing the model sends the backend a warm-up (model
+# and the last few messages) so it can build the session's memory before the
+# first query. Triggers within WARMUP_DEBOUNCE seconds of each other send one
+# warm-up. BIPP_WARMUP=0 turns this off.
+WARMUP_ENABLED = os.environ.get("BIPP_WARMUP", "1") != "0"
+WARMUP_DEBOUNCE = 0.5
+WARMUP_HISTORY_MESSAGES = 6
+WARMUP_MESSAGE_CHARS = 2000
 
 # Initialize session state
 for key, default in [
     ("messages", []),
+    ("has_older_messages", False),
+    ("has_newer_messages", False),
+    ("history_session_id", None),
     ("session_id", str(uuid.uuid4())),
     ("session_name", "Nova Sessão"),
+    ("persisted_session_id", None),
     ("api_status", "unknown"),
     ("available_models", {}),
     ("selected_model", "openai:gpt-4o-mini"),
     ("all_sessions", []),
-    ("streaming_response", ""),
+    ("has_more_sessions", False),
+    ("session_list_key", None),
+    ("session_list_limit", SESSION_PAGE_SIZE),
+    ("session_search", ""),
+    ("watched_job_ids", []),
+    ("bypass_cache", False),
+    ("show_performance", False),
+    ("pending_render_metrics", []),
+    ("compare_mode", False),
+    ("compare_models", []),
+    ("owner", None),
     ("is_processing", False)
 ]:
     if key not in st.session_state:
         st.session_state[key] = default
 
 # Database functions
+def load_storage_location():
+    url = os.environ.get("BIPP_DATABASE_URL")
+    if not url:
+        try:
+            url = st.secrets.get("storage", {}).get("url")
+        except FileNotFoundError:
+            url = None
+    return url or SESSIONS_DB
+
+@st.cache_resource
+def get_session_store() -> BaseSessionStore:
+    return open_session_store(load_storage_location(), worker_id=REPLICA_ID)
+
+@st.cache_resource
+def get_session_archive() -> Archive:
+    return open_archive(get_session_store(), ARCHIVE_DIR)
+
+def load_auth_config():
+    try:
+        return st.secrets.get("auth")
+    except FileNotFoundError:
+        return None
+
+def login_provider(auth: dict):
+    # A single provider configured directly under [auth] is the default;
+    # otherwise use the first [auth.<provider>] section
+    if "client_id" in auth:
+        return None
+    return next((name for name, value in auth.items() if hasattr(value, "get")), None)
+
+def resolve_owner():
+    # None means the visitor cannot be identified (yet)
+    if USER_HEADER:
+        return (st.context.headers.get(USER_HEADER) or "").strip() or None
+    if st.user.get("is_logged_in"):
+        return st.user.get("email") or st.user.get("sub")
+    if load_auth_config():
+        return None
+    return ANONYMOUS_OWNER
+
+def require_login():
+    st.info("Entre com sua conta para acessar o BIPP Analytics.")
+    if st.button("Entrar", type="primary"):
+        st.login(login_provider(load_auth_config()))
+    st.stop()
+
 def init_sessions_db():
-    conn = sqlite3.connect(SESSIONS_DB)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS sessions (
-            session_id TEXT PRIMARY KEY,
-            session_name TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT NOT NULL,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (session_id) REFERENCES sessions (session_id)
-        )
-        """
-    )
-    conn.commit()
-    conn.close()
+    get_session_store()
 
 def save_session(session_id: str, session_name: str):
-    conn = sqlite3.connect(SESSIONS_DB)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT OR REPLACE INTO sessions (session_id, session_name, last_activity)
-        VALUES (?, ?, CURRENT_TIMESTAMP)
-        """,
-        (session_id, session_name)
-    )
-    conn.commit()
-    conn.close()
-
-def save_message(session_id: str, role: str, content: str, timestamp: str):
-    conn = sqlite3.connect(SESSIONS_DB)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO messages (session_id, role, content, timestamp)
-        VALUES (?, ?, ?, ?)
-        """,
-        (session_id, role, content, timestamp)
-    )
-    cursor.execute(
-        """
-        UPDATE sessions SET last_activity = CURRENT_TIMESTAMP
-        WHERE session_id = ?
-        """,
-        (session_id,)
-    )
-    conn.commit()
-    conn.close()
-
-def load_session_messages(session_id: str):
-    conn = sqlite3.connect(SESSIONS_DB)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT role, content, timestamp FROM messages
-        WHERE session_id = ?
-        ORDER BY created_at ASC
-        """,
-        (session_id,)
-    )
-    rows = cursor.fetchall()
-    conn.close()
-    return [{"role": r[0], "content": r[1], "timestamp": r[2]} for r in rows]
-
-def get_all_sessions():
-    conn = sqlite3.connect(SESSIONS_DB)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT session_id, session_name, last_activity
-        FROM sessions
-        ORDER BY last_activity DESC
-        """
-    )
-    rows = cursor.fetchall()
-    conn.close()
-    return [
-        {"session_id": r[0], "session_name": r[1], "last_activity": r[2]}
-        for r in rows
-    ]
+    get_session_store().save_session(session_id, session_name, st.session_state.owner)
+
+def save_message(
+    session_id: str,
+    role: str,
+    content: str,
+    timestamp: str,
+    cached: bool = False,
+    model_id: str = None,
+    group_id: str = None
+):
+    get_session_store().save_message(session_id, role, content, timestamp, cached, model_id, group_id)
+
+def load_session_messages(session_id: str, limit: int = None, before_id: int = None):
+    return get_session_store().load_session_messages(session_id, limit, before_id, owner=st.session_state.owner)
+
+def refresh_session_list():
+    # Only hit the database when the store reports a change, or when the
+    # page size or search text changed since the list was last built
+    store = get_session_store()
+    limit = st.session_state.session_list_limit
+    search = st.session_state.session_search.strip()
+    key = (store.sessions_version, limit, search)
+    if st.session_state.session_list_key == key:
+        return
+    if search:
+        page = store.search_sessions(search, limit + 1, owner=st.session_state.owner)
+    else:
+        page = store.list_sessions(limit + 1, owner=st.session_state.owner)
+    st.session_state.has_more_sessions = len(page) > limit
+    st.session_state.all_sessions = page[:limit]
+    st.session_state.session_list_key = key
+
+def show_more_sessions():
+    st.session_state.session_list_limit += SESSION_PAGE_SIZE
 
 def delete_session(session_id: str):
-    conn = sqlite3.connect(SESSIONS_DB)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
-    cursor.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
-    conn.commit()
-    conn.close()
+    if get_session_store().delete_session(session_id, owner=st.session_state.owner):
+        get_session_archive().delete(session_id)
+
+def clear_session_messages(session_id: str):
+    get_session_store().clear_session_messages(session_id, owner=st.session_state.owner)
+
+def flush_pending_writes():
+    get_session_store().flush()
 
 def switch_session(session_id: str, session_name: str):
+    flush_pending_writes()
+    try:
+        rehydrate_session(get_session_store(), get_session_archive(), session_id)
+    except Exception as e:
+        st.error(f"Não foi possível restaurar a sessão arquivada: {e}")
     st.session_state.session_id = session_id
     st.session_state.session_name = session_name
-    st.session_state.messages = load_session_messages(session_id)
+    st.session_state.persisted_session_id = session_id
+    st.session_state.watched_job_ids = []
+    load_latest_messages(session_id)
+    warm_up_session()
+
+def load_latest_messages(session_id: str):
+    # Fetch one extra row to know whether there is anything older to page in
+    page = load_session_messages(session_id, limit=MESSAGE_PAGE_SIZE + 1)
+    st.session_state.has_older_messages = len(page) > MESSAGE_PAGE_SIZE
+    st.session_state.has_newer_messages = False
+    st.session_state.messages = page[-MESSAGE_PAGE_SIZE:]
+    st.session_state.history_session_id = session_id
+
+def load_older_messages():
+    messages = st.session_state.messages
+    if not messages or messages[0].id is None:
+        st.session_state.has_older_messages = False
+        return
+    page = load_session_messages(
+        st.session_state.session_id,
+        limit=MESSAGE_PAGE_SIZE + 1,
+        before_id=messages[0].id
+    )
+    st.session_state.has_older_messages = len(page) > MESSAGE_PAGE_SIZE
+    messages = page[-MESSAGE_PAGE_SIZE:] + messages
+    if len(messages) > MAX_MESSAGES_IN_MEMORY:
+        messages = messages[:MAX_MESSAGES_IN_MEMORY]
+        st.session_state.has_newer_messages = True
+    st.session_state.messages = messages
+
+def load_newest_messages():
+    load_latest_messages(st.session_state.session_id)
+
+def append_messages(*messages: Message):
+    # Callers store messages before appending them here
+    if st.session_state.has_newer_messages:
+        # The window was paged back; jump to the latest page, which includes them
+        load_latest_messages(st.session_state.session_id)
+        return
+    st.session_state.messages.extend(messages)
+    if len(st.session_state.messages) > MAX_MESSAGES_IN_MEMORY:
+        # Reload rather than slice, so the window starts at a stored message
+        # (with an id) that older pages can be fetched from
+        load_latest_messages(st.session_state.session_id)
 
 # API helpers
-def check_api_health():
-    try:
-        res = requests.get(HEALTH_ENDPOINT, timeout=5)
-        if res.status_code == 200:
-            data = res.json()
-            st.session_state.api_status = data.get("status", "unknown")
-            return data
-        st.session_state.api_status = "offline"
-    except requests.exceptions.RequestException:
-        st.session_state.api_status = "offline"
-    return None
-
-def get_available_models():
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    return build_session()
+
+def load_backend_urls() -> list:
+    urls = os.environ.get("BIPP_API_BASE_URLS") or os.environ.get("BIPP_API_BASE_URL")
+    if urls:
+        return [url.strip() for url in urls.split(",") if url.strip()]
     try:
-        res = requests.get(MODELS_ENDPOINT, timeout=10)
-        if res.status_code == 200:
-            data = res.json()
-            st.session_state.available_models = data.get("models", {})
-            return data
-    except requests.exceptions.RequestException:
-        pass
-    return None
+        urls = st.secrets.get("backend", {}).get("urls")
+    except FileNotFoundError:
+        urls = None
+    backends_file = os.environ.get("BIPP_BACKENDS_FILE")
+    if not urls and backends_file:
+        urls = toml.load(backends_file).get("backend", {}).get("urls")
+    return list(urls or [DEFAULT_API_BASE_URL])
+
+@st.cache_resource
+def get_backend_monitor() -> BackendMonitor:
+    return BackendMonitor(
+        get_http_session(),
+        load_backend_urls(),
+        health_path=HEALTH_PATH,
+        models_path=MODELS_PATH,
+        interval=BACKEND_REFRESH_INTERVAL
+    )
+
+def check_api_health():
+    monitor = get_backend_monitor()
+    monitor.refresh(force=True)
+    sync_backend_status()
+    return monitor.health
+
+def sync_backend_status():
+    # Health and the model catalog come from the shared monitor snapshot;
+    # the read-only catalog is shared, not copied, across browser sessions.
+    monitor = get_backend_monitor()
+    st.session_state.api_status = monitor.status
+    st.session_state.available_models = monitor.models
 
 def clear_session_memory():
-    try:
-        res = requests.post(f"{CLEAR_SESSION_ENDPOINT}/{st.session_state.session_id}")
-        if res.status_code == 200:
-            return res.json()
-        return {"status": "error", "error": f"HTTP {res.status_code}"}
-    except requests.exceptions.RequestException as e:
-        return {"status": "error", "error": str(e)}
-
-def stream_sql_query_generator(query: str, session_id: str, model_id: str):
-    try:
-        payload = {"query": query, "session_id": session_id, "model_id": model_id, "stream": True, "debug_mode": False}
-        res = requests.post(SQL_QUERY_ENDPOINT, json=payload, stream=True, timeout=300)
-        if res.status_code != 200:
-            yield {"status": "error", "error": f"HTTP {res.status_code}: {res.text}"}
+    # After a failover more than one node may hold memory for this session
+    cleared, error = None, "Nenhum backend disponível."
+    for backend in get_backend_monitor().backends:
+        if backend.status == "offline":
+            continue
+        try:
+            res = get_http_session().post(
+                backend.url(f"{CLEAR_SESSION_PATH}/{st.session_state.session_id}"),
+                timeout=TIMEOUTS["clear_session"]
+            )
+            if res.status_code == 200:
+                cleared = res.json()
+            else:
+                error = f"HTTP {res.status_code}"
+        except requests.exceptions.RequestException as e:
+            error = str(e)
+    return cleared if cleared is not None else {"status": "error", "error": error}
+
+def can_fail_over(error: SSEStreamError, responded: bool) -> bool:
+    # Only retry elsewhere when the query cannot have run: a gateway answered
+    # for an unavailable node, or the connection failed before any response.
+    # Once a node has accepted the query, a read timeout while streaming also
+    # surfaces as a ConnectionError, and the query must not run twice.
+    if error.status_code in RETRYABLE_STATUSES:
+        return True
+    return not responded and isinstance(error.__cause__, requests.exceptions.ConnectionError)
+
+def request_backend_cancel(http: requests.Session, backend: Backend, session_id: str):
+    # Best effort and off the worker thread: our side of the stream is
+    # already closed, this only lets the backend stop spending on the query
+    def send():
+        try:
+            http.post(backend.url(f"{CANCEL_PATH}/{session_id}"), timeout=TIMEOUTS["cancel"])
+        except requests.exceptions.RequestException:
+            pass
+    threading.Thread(target=send, name="bipp-cancel", daemon=True).start()
+
+def send_backend_warmup(http: requests.Session, monitor: BackendMonitor, session_id: str, payload: dict):
+    backend = monitor.choose(session_id)
+    if backend is None:
+        return
+    res = http.post(backend.url(f"{WARMUP_PATH}/{session_id}"), json=payload, timeout=TIMEOUTS["warmup"])
+    if res.status_code == 200:
+        # Send the first query to the node that now holds the session's memory
+        monitor.assign(session_id, backend)
+
+@st.cache_resource
+def get_warmup_scheduler():
+    if not WARMUP_ENABLED:
+        return None
+    return WarmupScheduler(
+        functools.partial(send_backend_warmup, get_http_session(), get_backend_monitor()),
+        debounce=WARMUP_DEBOUNCE
+    )
+
+def warm_up_session():
+    scheduler = get_warmup_scheduler()
+    if scheduler is None:
+        return
+    history = [
+        {"role": message.role, "content": message.content[:WARMUP_MESSAGE_CHARS]}
+        for message in st.session_state.messages[-WARMUP_HISTORY_MESSAGES:]
+    ]
+    scheduler.schedule(
+        st.session_state.session_id,
+        {"model_id": st.session_state.selected_model, "history": history}
+    )
+
+def change_model():
+    st.session_state.selected_model = st.session_state.model_selector
+    warm_up_session()
+
+def stream_from_backend(
+    http: requests.Session,
+    backend: Backend,
+    payload: dict,
+    timer: QueryTimer = None,
+    cancel: CancelToken = None,
+    on_response: Callable[[], None] = None
+):
+    sent_at = time.monotonic()
+
+    def response_received():
+        if timer is None or timer.offset("connect") is None:
+            backend.observe_latency((time.monotonic() - sent_at) * 1000)
+        if timer is not None:
+            timer.mark_once("connect")
+        if on_response is not None:
+            on_response()
+
+    for event in stream_events(
+        http,
+        backend.url(SQL_QUERY_PATH),
+        payload,
+        timeout=TIMEOUTS["sql_query"],
+        deadline=SQL_QUERY_DEADLINE,
+        on_response=response_received,
+        cancel=cancel
+    ):
+        try:
+            data = sse_loads(event.data)
+        except ValueError:
+            # Skip a malformed frame instead of losing the whole response
+            continue
+        if isinstance(data, dict):
+            yield data
+
+def stream_sql_query_generator(
+    query: str,
+    session_id: str,
+    model_id: str,
+    http: requests.Session = None,
+    timer: QueryTimer = None,
+    monitor: BackendMonitor = None,
+    cancel: CancelToken = None
+):
+    payload = {"query": query, "session_id": session_id, "model_id": model_id, "stream": True, "debug_mode": False}
+    http = http or get_http_session()
+    monitor = monitor or get_backend_monitor()
+    tried = []
+    error = "Nenhum backend disponível."
+    while cancel is None or not cancel.cancelled:
+        backend = monitor.choose(session_id, exclude=tried)
+        if backend is None:
+            yield {"status": "error", "error": error}
+            return
+        tried.append(backend)
+        received = False
+        responses = []
+        try:
+            with backend.track():
+                for data in stream_from_backend(
+                    http, backend, payload, timer, cancel, on_response=lambda: responses.append(True)
+                ):
+                    if not received:
+                        received = True
+                        backend.breaker.record_success()
+                        monitor.assign(session_id, backend)
+                    yield data
+            return
+        except SSEStreamError as e:
+            if e.status_code is None or e.status_code >= 500:
+                backend.breaker.record_failure()
+            if received or not can_fail_over(e, responded=bool(responses)):
+                yield {"status": "error", "error": str(e)}
+                return
+            error = str(e)
+        except requests.exceptions.RequestException as e:
+            yield {"status": "error", "error": str(e)}
             return
-        for line in res.iter_lines(decode_unicode=True):
-            if line and line.startswith("data: "):
-                data = json.loads(line[6:])
-                yield data
-    except requests.exceptions.RequestException as e:
-        yield {"status": "error", "error": str(e)}
-
-def display_message(role: str, content: str, timestamp: str = None):
+        finally:
+            if cancel is not None and cancel.cancelled:
+                request_backend_cancel(http, backend, session_id)
+
+@st.cache_resource
+def get_response_cache():
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    return ResponseCache(
+        RESPONSE_CACHE_DB,
+        ttl=RESPONSE_CACHE_TTL,
+        max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+        epoch=DATA_EPOCH
+    )
+
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    http = get_http_session()
+    monitor = get_backend_monitor()
+    return JobManager(
+        get_session_store(),
+        lambda query, session_id, model_id, timer, cancel: stream_sql_query_generator(
+            query, session_id, model_id, http, timer, monitor, cancel
+        ),
+        max_workers=QUERY_WORKERS,
+        response_cache=get_response_cache()
+    )
+
+@st.cache_resource(max_entries=16)
+def load_result_preview(result_id: str):
+    # Result sets are immutable, so the decoded preview is shared across
+    # reruns and sessions instead of being copied like st.cache_data would.
+    # Only the preview rows are decoded; the rest stays compressed.
+    blob = get_session_store().load_result(result_id)
+    return decode_preview(blob.payload, RESULT_PREVIEW_ROWS) if blob is not None else None
+
+def display_result(result_id: str):
+    preview = load_result_preview(result_id)
+    if preview is None:
+        return
+    table, total_rows = preview
+    if total_rows > table.num_rows:
+        st.caption(f"Exibindo {table.num_rows:,} de {total_rows:,} linhas".replace(",", "."))
+    st.dataframe(table, height=400, hide_index=True)
+    display_export_actions(result_id)
+
+def create_export(result_id: str, fmt: str):
+    blob = get_session_store().load_result(result_id)
+    if blob is None:
+        return None
+    purge_exports(EXPORT_DIR, EXPORT_MAX_AGE)
+    try:
+        return export_result(blob, fmt, EXPORT_DIR)
+    except ExportTooLargeError:
+        limit_mb = MAX_STATIC_FILE_BYTES // (1024 * 1024)
+        hint = " Exporte em Parquet." if fmt == "csv" else ""
+        st.error(f"O arquivo {fmt.upper()} passaria do limite de {limit_mb} MB para download.{hint}")
+        return None
+
+def display_export_actions(result_id: str):
+    for col, fmt in zip(st.columns(len(EXPORT_FORMATS)), EXPORT_FORMATS):
+        with col:
+            path = export_path(EXPORT_DIR, result_id, fmt)
+            if path is None and st.button(f"Exportar {fmt.upper()}", key=f"export_{fmt}_{result_id}"):
+                with st.spinner("Gerando arquivo..."):
+                    path = create_export(result_id, fmt)
+            if path is not None:
+                file_name = f"resultado-{result_id[:8]}{path.name[len(result_id):]}"
+                st.markdown(
+                    f'<a href="{EXPORT_URL_PREFIX}/{path.name}" download="{file_name}">Baixar {fmt.upper()}</a>',
+                    unsafe_allow_html=True
+                )
+
+def display_message(role: str, content: str, timestamp: str = None, cached: bool = False, result_id: str = None):
     with st.chat_message(role):
-        if timestamp:
-            st.caption(timestamp)
+        if timestamp or cached:
+            st.caption(" · ".join(filter(None, [timestamp, "⚡ resposta em cache" if cached else None])))
         st.markdown(content)
+        if result_id:
+            display_result(result_id)
+
+def format_latency(ms: float) -> str:
+    return f"{ms / 1000:.1f} s" if ms is not None else ""
+
+def display_comparison(answers: list):
+    # Answers to one prompt from several models, side by side
+    answers = sorted(answers, key=lambda answer: answer.model_id or "")
+    with st.chat_message("assistant"):
+        st.caption(f"{answers[0].timestamp} · Comparação de {len(answers)} modelos")
+        for column, answer in zip(st.columns(len(answers)), answers):
+            with column:
+                st.markdown(f"**{answer.model_id}**")
+                details = [format_latency(answer.latency_ms), "⚡ em cache" if answer.cached else None]
+                if any(details):
+                    st.caption(" · ".join(filter(None, details)))
+                st.markdown(answer.content)
+                if answer.result_id:
+                    display_result(answer.result_id)
+
+def group_messages(messages: list):
+    """Yield messages in runs, merging consecutive answers of one comparison."""
+    run = []
+    for msg in messages:
+        if run and msg.group_id and msg.group_id == run[-1].group_id:
+            run.append(msg)
+            continue
+        if run:
+            yield run
+        run = [msg]
+    if run:
+        yield run
 
 def show_spinner(text: str = "Processando sua consulta..."):
     """Display a custom spinner with text"""
@@ -349,137 +749,343 @@ def create_new_session():
     switch_session(new_id, new_name)
     return new_id, new_name
 
-# Sidebar content
+@st.cache_data(ttl=15)
+def get_recent_metrics():
+    return get_session_store().load_query_metrics(limit=METRICS_WINDOW)
+
+def render_performance_panel():
+    rows = get_recent_metrics()
+    with st.expander("Desempenho", expanded=True):
+        if not rows:
+            st.caption("Nenhuma consulta registrada ainda.")
+            return
+        summary = summarize(rows, fields=("connect_ms", "first_event_ms", "total_ms", "render_ms"))
+        table = []
+        for model_id, series in summary.items():
+            ttfb, total = series["first_event_ms"], series["total_ms"]
+            table.append({
+                "Modelo": model_id,
+                "N": total["count"],
+                "1º evento p50": ttfb[0.5],
+                "1º evento p95": ttfb[0.95],
+                "Total p50": total[0.5],
+                "Total p95": total[0.95],
+                "Total p99": total[0.99],
+            })
+        st.dataframe(table, hide_index=True)
+        st.caption(f"Tempos em ms · últimas {len(rows)} consultas")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                "Prometheus",
+                lambda: to_prometheus(summary),
+                file_name="bipp_metrics.prom",
+                mime="text/plain",
+                key="metrics_prometheus",
+                on_click="ignore"
+            )
+        with col2:
+            st.download_button(
+                "JSON Lines",
+                lambda: to_json_lines(rows),
+                file_name="bipp_metrics.jsonl",
+                mime="application/jsonl",
+                key="metrics_jsonl",
+                on_click="ignore"
+            )
+
+def render_memory_report():
+    # The model catalog is shared by every browser session, so it is not
+    # counted against this one
+    rows = memory_report(st.session_state.to_dict(), shared={id(get_backend_monitor().models)})
+    with st.expander("Memória da sessão"):
+        total_kib = sum(row["bytes"] for row in rows) / 1024
+        st.caption(
+            f"{total_kib:.1f} KiB · {len(st.session_state.messages)} mensagens em memória "
+            f"(máx. {MAX_MESSAGES_IN_MEMORY})"
+        )
+        st.dataframe(
+            [
+                {"Chave": row["key"], "KiB": round(row["bytes"] / 1024, 1), "Compartilhado": row["shared"]}
+                for row in rows[:15]
+            ],
+            hide_index=True
+        )
+
+# Sidebar content. The status/settings panel and the session list are
+# fragments, so toggles, searches and paging rerun only their own panel;
+# actions that change the chat (switching, renaming, clearing) rerun the app.
 def render_sidebar():
     with st.sidebar:
         st.markdown('<div class="sidebar-content">', unsafe_allow_html=True)
-        
-        # API Status Section
-        st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
-        st.markdown('<div class="sidebar-title">Status da API</div>', unsafe_allow_html=True)
-        
-        status_class = f"status-{st.session_state.api_status}"
-        status_texts = {"healthy": "Online", "offline": "Offline", "unknown": "Verificando"}
-        status_text = status_texts.get(st.session_state.api_status, "Desconhecido")
-        
-        st.markdown(f'''
-        <div class="status-indicator {status_class}">
-            <div class="status-dot"></div>
-            <span>{status_text}</span>
-        </div>
-        ''', unsafe_allow_html=True)
-        
-        if st.button("Verificar API", key="check_api", disabled=st.session_state.is_processing):
-            check_api_health()
-            st.rerun()
+        render_settings_panel()
+        render_session_list()
+        render_session_actions()
         st.markdown('</div>', unsafe_allow_html=True)
+
+@st.fragment
+def render_settings_panel():
+    # API Status Section
+    st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
+    st.markdown('<div class="sidebar-title">Status da API</div>', unsafe_allow_html=True)
+    
+    status_class = f"status-{st.session_state.api_status}"
+    status_texts = {"healthy": "Online", "offline": "Offline", "unknown": "Verificando"}
+    status_text = status_texts.get(st.session_state.api_status, "Desconhecido")
+    
+    st.markdown(f'''
+    <div class="status-indicator {status_class}">
+        <div class="status-dot"></div>
+        <span>{status_text}</span>
+    </div>
+    ''', unsafe_allow_html=True)
+    
+    monitor = get_backend_monitor()
+    if len(monitor.backends) > 1:
+        st.caption(f"{monitor.online} de {len(monitor.backends)} servidores online")
+    
+    if st.button("Verificar API", key="check_api"):
+        previous_status = st.session_state.api_status
+        check_api_health()
+        # The chat input only needs updating when the status actually changed
+        st.rerun(scope="app" if st.session_state.api_status != previous_status else "fragment")
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    # Model Selection Section
+    st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
+    st.markdown('<div class="sidebar-title">Configurações</div>', unsafe_allow_html=True)
+    
+    if st.session_state.available_models:
+        model_options = monitor.model_options
         
-        # Model Selection Section
-        st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
-        st.markdown('<div class="sidebar-title">Configurações</div>', unsafe_allow_html=True)
+        current_index = 0
+        if st.session_state.selected_model in model_options:
+            current_index = model_options.index(st.session_state.selected_model)
         
-        if not st.session_state.available_models:
-            get_available_models()
+        selected_model = st.selectbox(
+            "Modelo de IA",
+            model_options,
+            index=current_index,
+            key="model_selector",
+            on_change=change_model
+        )
+        st.session_state.selected_model = selected_model
         
-        if st.session_state.available_models:
-            model_options = []
-            for provider, models in st.session_state.available_models.items():
-                for model in models:
-                    model_options.append(f"{provider}:{model}")
-            
-            current_index = 0
-            if st.session_state.selected_model in model_options:
-                current_index = model_options.index(st.session_state.selected_model)
-            
-            selected_model = st.selectbox(
-                "Modelo de IA",
+        st.toggle(
+            "Comparar modelos",
+            key="compare_mode",
+            help="Envia a mesma pergunta a vários modelos ao mesmo tempo"
+        )
+        if st.session_state.compare_mode:
+            # Drop models that left the catalog; the widget rejects unknown values
+            st.session_state.compare_models = [
+                model for model in st.session_state.compare_models if model in model_options
+            ] or [selected_model]
+            st.multiselect(
+                "Modelos para comparar",
                 model_options,
-                index=current_index,
-                key="model_selector",
-                disabled=st.session_state.is_processing
+                key="compare_models",
+                max_selections=MAX_COMPARE_MODELS
             )
-            st.session_state.selected_model = selected_model
-        
-        st.markdown('</div>', unsafe_allow_html=True)
-        
-        # Session Management Section
-        st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
-        st.markdown('<div class="sidebar-title">Sessões</div>', unsafe_allow_html=True)
-        
-        # New session button
-        if st.button("Nova Sessão", key="new_session", disabled=st.session_state.is_processing):
-            create_new_session()
-            st.rerun()
-        
-        # Session list
-        if st.session_state.all_sessions:
-            st.markdown("**Sessões Ativas:**")
-            for session in st.session_state.all_sessions:
-                is_current = session['session_id'] == st.session_state.session_id
-                
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    button_label = f"{session['session_name']}"
-                    if len(button_label) > 20:
-                        button_label = button_label[:17] + "..."
-                    
-                    if st.button(
-                        button_label,
-                        key=f"session_{session['session_id']}",
-                        disabled=is_current or st.session_state.is_processing,
-                        help=f"ID: {session['session_id'][:8]}...\nÚltima atividade: {session['last_activity']}"
-                    ):
-                        switch_session(session['session_id'], session['session_name'])
-                        st.rerun()
+    
+    cache = get_response_cache()
+    if cache is not None:
+        st.toggle(
+            "Ignorar cache de respostas",
+            key="bypass_cache",
+            help="Envia a pergunta ao backend mesmo que já exista uma resposta em cache"
+        )
+        stats = cache.stats()
+        st.caption(f"Cache: {stats['hits']} acertos · {stats['misses']} falhas · {stats['entries']} respostas")
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    st.toggle("Mostrar desempenho", key="show_performance")
+    if st.session_state.show_performance:
+        render_performance_panel()
+        render_memory_report()
+
+@st.fragment
+def render_session_list():
+    # Searching, paging and deleting rerun only this fragment
+    refresh_session_list()
+    
+    st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
+    st.markdown('<div class="sidebar-title">Sessões</div>', unsafe_allow_html=True)
+    
+    # New session button
+    if st.button("Nova Sessão", key="new_session"):
+        create_new_session()
+        st.rerun()
+    
+    st.text_input(
+        "Buscar sessões",
+        key="session_search",
+        placeholder="Nome ou conteúdo da conversa"
+    )
+    
+    # Session list
+    if st.session_state.session_search.strip() and not st.session_state.all_sessions:
+        st.caption("Nenhuma sessão encontrada.")
+    
+    if st.session_state.all_sessions:
+        st.markdown("**Sessões Ativas:**")
+        manager = get_job_manager()
+        for session in st.session_state.all_sessions:
+            is_current = session.session_id == st.session_state.session_id
+            
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                button_label = f"{session.session_name}"
+                if len(button_label) > 20:
+                    button_label = button_label[:17] + "..."
                 
-                with col2:
-                    if not is_current and len(st.session_state.all_sessions) > 1:
-                        if st.button(
-                            "×", 
-                            key=f"delete_{session['session_id']}", 
-                            help="Deletar sessão",
-                            disabled=st.session_state.is_processing
-                        ):
-                            delete_session(session['session_id'])
-                            st.session_state.all_sessions = get_all_sessions()
-                            st.rerun()
-        
-        st.markdown('</div>', unsafe_allow_html=True)
-        
-        # Session Actions Section
-        st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
-        st.markdown('<div class="sidebar-title">Ações da Sessão</div>', unsafe_allow_html=True)
+                if st.button(
+                    button_label,
+                    key=f"session_{session.session_id}",
+                    disabled=is_current,
+                    help=f"ID: {session.session_id[:8]}...\nÚltima atividade: {session.last_activity}"
+                ):
+                    switch_session(session.session_id, session.session_name)
+                    st.rerun()
+            
+            with col2:
+                if not is_current:
+                    st.button(
+                        "×", 
+                        key=f"delete_{session.session_id}", 
+                        help="Deletar sessão",
+                        disabled=manager.running_job(session.session_id) is not None,
+                        on_click=delete_session,
+                        args=(session.session_id,)
+                    )
         
-        # Rename session
-        new_name = st.text_input(
-            "Renomear sessão",
-            value=st.session_state.session_name,
-            key="rename_input",
+        if st.session_state.has_more_sessions:
+            st.button("Mostrar mais", key="more_sessions", on_click=show_more_sessions)
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+
+def render_session_actions():
+    # Session Actions Section
+    st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
+    st.markdown('<div class="sidebar-title">Ações da Sessão</div>', unsafe_allow_html=True)
+    
+    # Rename session
+    st.text_input(
+        "Renomear sessão",
+        value=st.session_state.session_name,
+        key="rename_input",
+        disabled=st.session_state.is_processing
+    )
+    st.button("Salvar Nome", key="save_name", on_click=rename_current_session, disabled=st.session_state.is_processing)
+    
+    # Clear actions
+    st.button("Limpar Chat", key="clear_chat", on_click=clear_current_chat, disabled=st.session_state.is_processing)
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+
+def rename_current_session():
+    new_name = st.session_state.rename_input
+    if new_name and new_name != st.session_state.session_name:
+        st.session_state.session_name = new_name
+        save_session(st.session_state.session_id, new_name)
+        st.toast("Nome atualizado!")
+
+def clear_current_chat():
+    clear_session_messages(st.session_state.session_id)
+    st.session_state.messages = []
+    st.session_state.has_older_messages = False
+    st.session_state.has_newer_messages = False
+    st.toast("Chat limpo!")
+
+# Chat history. Only the latest MESSAGE_PAGE_SIZE messages are loaded and
+# rendered; paging in older ones reruns this fragment alone.
+@st.fragment
+def render_chat_history():
+    if st.session_state.has_older_messages:
+        st.button(
+            "Carregar mensagens anteriores",
+            key="load_older_messages",
+            on_click=load_older_messages,
             disabled=st.session_state.is_processing
         )
-        
-        if st.button("Salvar Nome", key="save_name", disabled=st.session_state.is_processing):
-            if new_name and new_name != st.session_state.session_name:
-                st.session_state.session_name = new_name
-                save_session(st.session_state.session_id, new_name)
-                st.success("Nome atualizado!")
-                time.sleep(1)
-                st.rerun()
-        
-        # Clear actions
-        if st.button("Limpar Chat", key="clear_chat", disabled=st.session_state.is_processing):
-            conn = sqlite3.connect(SESSIONS_DB)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM messages WHERE session_id = ?', (st.session_state.session_id,))
-            conn.commit()
-            conn.close()
-            st.session_state.messages = []
-            st.success("Chat limpo!")
-            time.sleep(1)
-            st.rerun()
-        
-        st.markdown('</div>', unsafe_allow_html=True)
-        st.markdown('</div>', unsafe_allow_html=True)
+    
+    for run in group_messages(st.session_state.messages):
+        if run[0].group_id:
+            display_comparison(run)
+            continue
+        msg = run[0]
+        display_message(msg.role, msg.content, msg.timestamp, msg.cached, msg.result_id)
+    
+    if st.session_state.has_newer_messages:
+        st.button(
+            "Mostrar mensagens recentes",
+            key="load_newest_messages",
+            on_click=load_newest_messages
+        )
+    
+    # Time from a job finishing to its answer being on the page
+    for job_id, finished_at in st.session_state.pending_render_metrics:
+        get_session_store().save_render_time(job_id, round((time.monotonic() - finished_at) * 1000, 2))
+    st.session_state.pending_render_metrics = []
+
+# Progress of the current session's running query (or comparison), polled
+# from its jobs
+@st.fragment(run_every=1 / RENDER_FPS)
+def render_job_progress():
+    manager = get_job_manager()
+    jobs = [job for job in map(manager.get, st.session_state.watched_job_ids) if job is not None]
+    if not jobs:
+        return
+    if all(job.done for job in jobs):
+        st.session_state.watched_job_ids = []
+        st.session_state.pending_render_metrics = [(job.job_id, job.finished_at) for job in jobs]
+        append_messages(*(
+            Message(
+                "assistant",
+                job.content,
+                job.assistant_ts,
+                result_id=job.result_id,
+                model_id=job.model_id,
+                group_id=job.group_id,
+                latency_ms=job.elapsed_ms
+            )
+            for job in jobs if job.session_id == st.session_state.session_id
+        ))
+        st.rerun()
+    
+    if len(jobs) > 1:
+        render_comparison_progress(jobs)
+    else:
+        job = jobs[0]
+        with st.chat_message("assistant"):
+            st.caption(job.assistant_ts)
+            if job.partial:
+                st.markdown(job.partial + " ▌")
+            else:
+                show_spinner(job.status_message)
+    st.button("Parar", key="stop_query", on_click=stop_watched_jobs, help="Interrompe a consulta e salva a resposta parcial")
+
+def stop_watched_jobs():
+    manager = get_job_manager()
+    for job_id in st.session_state.watched_job_ids:
+        manager.cancel(job_id)
+
+def render_comparison_progress(jobs: list):
+    jobs = sorted(jobs, key=lambda job: job.model_id)
+    with st.chat_message("assistant"):
+        st.caption(f"{jobs[0].assistant_ts} · Comparação de {len(jobs)} modelos")
+        for column, job in zip(st.columns(len(jobs)), jobs):
+            with column:
+                st.markdown(f"**{job.model_id}**")
+                st.caption(format_latency(job.elapsed_ms))
+                if job.done:
+                    st.markdown(job.content)
+                elif job.partial:
+                    st.markdown(job.partial + " ▌")
+                else:
+                    show_spinner(job.status_message)
 
 # Main content
 def render_main_content():
@@ -498,12 +1104,17 @@ def render_main_content():
     st.markdown(f'<div class="chat-header">Chat: {current_session_name}</div>', unsafe_allow_html=True)
     
     # Load and display messages
-    if not st.session_state.messages:
-        st.session_state.messages = load_session_messages(st.session_state.session_id)
+    if st.session_state.history_session_id != st.session_state.session_id:
+        load_latest_messages(st.session_state.session_id)
+    
+    render_chat_history()
     
-    # Display existing messages
-    for msg in st.session_state.messages:
-        display_message(msg['role'], msg['content'], msg.get('timestamp'))
+    manager = get_job_manager()
+    if any(
+        job is not None and job.session_id == st.session_state.session_id
+        for job in map(manager.get, st.session_state.watched_job_ids)
+    ):
+        render_job_progress()
     
     st.markdown('</div>', unsafe_allow_html=True)
     
@@ -512,98 +1123,103 @@ def render_main_content():
     if st.session_state.api_status != "healthy":
         st.warning("Verifique a conexão para continuar.")
     
-    if prompt := st.chat_input(
+    # Submitting runs submit_prompt before the rerun it triggers, so the
+    # rerun already shows the question and the query in progress
+    st.chat_input(
         "Digite sua pergunta sobre dados da BIPP...", 
-        disabled=chat_disabled
-    ):
-        # Set processing state
-        st.session_state.is_processing = True
-        
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        user_msg = {"role": "user", "content": prompt, "timestamp": timestamp}
-        st.session_state.messages.append(user_msg)
-        save_message(st.session_state.session_id, 'user', prompt, timestamp)
-        display_message('user', prompt, timestamp)
-
-        assistant_ts = datetime.now().strftime("%H:%M:%S")
-        st.session_state.streaming_response = ""
-        
-        with st.chat_message("assistant"):
-            st.caption(assistant_ts)
-            
-            # Show spinner while processing
-            spinner_container = st.empty()
-            with spinner_container.container():
-                show_spinner("Processando sua consulta...")
-            
-            # Container for the actual response
-            response_container = st.empty()
-            
-            try:
-                response_received = False
-                for chunk in stream_sql_query_generator(prompt, st.session_state.session_id, st.session_state.selected_model):
-                    if chunk.get('status') == 'processing':
-                        # Update spinner text with more specific message if available
-                        processing_msg = chunk.get('message', 'Processando...')
-                        spinner_container.empty()
-                        with spinner_container.container():
-                            show_spinner(processing_msg)
-                        time.sleep(0.1)
-                    elif chunk.get('status') == 'completed':
-                        content = chunk.get('reasoning', 'Nenhuma resposta recebida')
-                        spinner_container.empty()  # Remove spinner
-                        response_container.markdown(content)
-                        assistant_msg = {"role": "assistant", "content": content, "timestamp": assistant_ts}
-                        st.session_state.messages.append(assistant_msg)
-                        save_message(st.session_state.session_id, 'assistant', content, assistant_ts)
-                        response_received = True
-                        break
-                    elif chunk.get('status') == 'error':
-                        err = f"**Erro:** {chunk.get('error', 'Erro desconhecido')}"
-                        spinner_container.empty()  # Remove spinner
-                        response_container.error(err)
-                        save_message(st.session_state.session_id, 'assistant', err, assistant_ts)
-                        response_received = True
-                        break
-                
-                # If no response was received, show timeout message
-                if not response_received:
-                    spinner_container.empty()
-                    timeout_msg = "**Timeout:** A consulta demorou muito para responder."
-                    response_container.error(timeout_msg)
-                    save_message(st.session_state.session_id, 'assistant', timeout_msg, assistant_ts)
-                    
-            except Exception as e:
-                err = f"**Erro inesperado:** {str(e)}"
-                spinner_container.empty()  # Remove spinner
-                response_container.error(err)
-                save_message(st.session_state.session_id, 'assistant', err, assistant_ts)
-            
-            finally:
-                # Reset processing state
-                st.session_state.is_processing = False
-        
-        time.sleep(0.5)
+        key="chat_prompt",
+        disabled=chat_disabled,
+        on_submit=submit_prompt
+    )
+
+def submit_prompt():
+    prompt = st.session_state.chat_prompt
+    manager = get_job_manager()
+    if not prompt or manager.running_jobs(st.session_state.session_id):
+        return
+    # The query itself builds the session's memory now
+    scheduler = get_warmup_scheduler()
+    if scheduler is not None:
+        scheduler.cancel(st.session_state.session_id)
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    save_message(st.session_state.session_id, 'user', prompt, timestamp)
+    append_messages(Message("user", prompt, timestamp))
+
+    # In comparison mode the prompt fans out to every selected model;
+    # their answers are linked by a shared group_id
+    models = [st.session_state.selected_model]
+    if st.session_state.compare_mode and len(st.session_state.compare_models) > 1:
+        models = list(st.session_state.compare_models)
+    group_id = str(uuid.uuid4()) if len(models) > 1 else None
+    assistant_ts = datetime.now().strftime("%H:%M:%S")
+
+    # Repeated questions are answered from the response cache
+    cache = get_response_cache()
+    pending_models = []
+    for model_id in models:
+        cached_answer = None
+        if cache is not None and not st.session_state.bypass_cache:
+            cached_answer = cache.get(prompt, model_id)
+        if cached_answer is None:
+            pending_models.append(model_id)
+            continue
+        save_message(
+            st.session_state.session_id, 'assistant', cached_answer, assistant_ts,
+            cached=True, model_id=model_id, group_id=group_id
+        )
+        append_messages(
+            Message("assistant", cached_answer, assistant_ts, cached=True, model_id=model_id, group_id=group_id)
+        )
+
+    # Queries run concurrently on background workers, which also store the answers
+    st.session_state.watched_job_ids = [
+        manager.submit(st.session_state.session_id, prompt, model_id, assistant_ts, group_id).job_id
+        for model_id in pending_models
+    ]
+
+# Reruns the page when the shared backend status changes, e.g. once the
+# first health check completes after the initial render
+@st.fragment(run_every=STATUS_POLL_INTERVAL)
+def watch_backend_status():
+    if get_backend_monitor().status != st.session_state.api_status:
         st.rerun()
 
 # Main app
 def main():
+    if st.session_state.owner is None:
+        st.session_state.owner = resolve_owner()
+        if st.session_state.owner is None:
+            if not USER_HEADER:
+                require_login()
+            st.error("Usuário não identificado. Acesse o BIPP Analytics pelo portal autenticado.")
+            st.stop()
     init_sessions_db()
-    save_session(st.session_state.session_id, st.session_state.session_name)
-    st.session_state.all_sessions = get_all_sessions()
+    # Only the first run of a browser session needs to create its row;
+    # activity is recorded when messages are saved
+    if st.session_state.persisted_session_id != st.session_state.session_id:
+        save_session(st.session_state.session_id, st.session_state.session_name)
+        st.session_state.persisted_session_id = st.session_state.session_id
+        warm_up_session()
+    refresh_session_list()
     
     # Check if we have any sessions, create one if not
-    if not st.session_state.all_sessions:
+    if not st.session_state.all_sessions and not st.session_state.session_search.strip():
         create_new_session()
-        st.rerun()
+        refresh_session_list()
+    
+    sync_backend_status()
+    
+    # A query in flight only locks the session it belongs to
+    running_ids = [job.job_id for job in get_job_manager().running_jobs(st.session_state.session_id)]
+    st.session_state.is_processing = bool(running_ids)
+    if not set(running_ids) <= set(st.session_state.watched_job_ids):
+        st.session_state.watched_job_ids = running_ids
     
     # Render sidebar and main content
     render_sidebar()
     render_main_content()
     
-    # Check API status on first load
-    if st.session_state.api_status == "unknown":
-        check_api_health()
+    watch_backend_status()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,213 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Optional, Sequence
+
+import requests
+
+from http_client import TIMEOUTS
+
+# Latency assumed for a node that has not answered a health check yet
+DEFAULT_LATENCY_MS = 100.0
+LATENCY_EWMA_ALPHA = 0.3
+
+# Sessions remembered for backend affinity
+MAX_AFFINITY_SESSIONS = 10_000
+
+
+class CircuitBreaker:
+    """Stops calling a failing dependency for ``reset_timeout`` seconds after
+    ``failure_threshold`` consecutive failures, then lets one trial call through."""
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "half-open":
+                # Re-arm the timer so only one caller gets the trial request
+                self.opened_at = time.monotonic()
+            return state != "open"
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class Backend:
+    """One backend node with its own breaker, in-flight count and latency estimate."""
+
+    def __init__(self, base_url: str, breaker: CircuitBreaker = None):
+        self.base_url = base_url.rstrip("/")
+        self.breaker = breaker or CircuitBreaker()
+        self.status = "unknown"
+        self.health = None
+        self.latency_ms = None
+        self.outstanding = 0
+        self._lock = threading.Lock()
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    @property
+    def available(self) -> bool:
+        return self.status == "healthy" and self.breaker.state == "closed"
+
+    def score(self) -> float:
+        # Least outstanding requests, weighted by observed latency
+        return (self.outstanding + 1) * (self.latency_ms or DEFAULT_LATENCY_MS)
+
+    def observe_latency(self, ms: float):
+        with self._lock:
+            if self.latency_ms is None:
+                self.latency_ms = ms
+            else:
+                self.latency_ms += LATENCY_EWMA_ALPHA * (ms - self.latency_ms)
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self.outstanding += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.outstanding -= 1
+
+
+class BackendMonitor:
+    """Process-wide view of backend health and the model catalog.
+
+    A daemon thread health-checks every backend node every ``interval``
+    seconds, so page renders only read the latest snapshot and never wait on
+    the network. ``choose`` picks the node for a query from that snapshot.
+    """
+
+    def __init__(
+        self,
+        http: requests.Session,
+        base_urls: Sequence[str],
+        health_path: str = "/health",
+        models_path: str = "/models",
+        interval: float = 30.0,
+    ):
+        self.http = http
+        self.backends = [Backend(url) for url in base_urls]
+        self.health_path = health_path
+        self.models_path = models_path
+        self.interval = interval
+        self.status = "unknown"
+        self.health = None
+        self.models = MappingProxyType({})
+        self.model_options = ()
+        self.checked_at = None
+        self._affinity = OrderedDict()
+        self._affinity_lock = threading.Lock()
+        self._checks = ThreadPoolExecutor(max_workers=len(self.backends), thread_name_prefix="bipp-health")
+        self._refresh_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="bipp-backend-monitor", daemon=True)
+        self._thread.start()
+
+    @property
+    def online(self) -> int:
+        return sum(backend.status == "healthy" for backend in self.backends)
+
+    def refresh(self, force: bool = False):
+        with self._refresh_lock:
+            # Check nodes in parallel so one unreachable node does not delay the rest
+            list(self._checks.map(lambda backend: self._check(backend, force), self.backends))
+            healthy = [backend for backend in self.backends if backend.status == "healthy"]
+            primary = min(healthy, key=Backend.score) if healthy else self.backends[0]
+            self.health = primary.health
+            self.status = primary.status
+            if healthy:
+                self._refresh_models(primary)
+            self.checked_at = time.time()
+
+    def _check(self, backend: Backend, force: bool):
+        if not force and not backend.breaker.allow():
+            backend.status = "offline"
+            return
+        start = time.monotonic()
+        try:
+            res = self.http.get(backend.url(self.health_path), timeout=TIMEOUTS["health"])
+            if res.status_code != 200:
+                raise requests.exceptions.HTTPError(f"HTTP {res.status_code}")
+            backend.health = res.json()
+            backend.status = backend.health.get("status", "unknown")
+            backend.observe_latency((time.monotonic() - start) * 1000)
+            backend.breaker.record_success()
+        except (requests.exceptions.RequestException, ValueError):
+            backend.health = None
+            backend.status = "offline"
+            backend.breaker.record_failure()
+
+    def _refresh_models(self, backend: Backend):
+        try:
+            res = self.http.get(backend.url(self.models_path), timeout=TIMEOUTS["models"])
+            if res.status_code == 200:
+                models = {provider: tuple(names) for provider, names in res.json().get("models", {}).items()}
+                if models != self.models:
+                    # Swap in a new read-only catalog, so readers never see a
+                    # partial update and every browser session can share it
+                    self.model_options = tuple(
+                        f"{provider}:{name}" for provider, names in models.items() for name in names
+                    )
+                    self.models = MappingProxyType(models)
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+
+    def choose(self, session_id: Optional[str] = None, exclude: Sequence[Backend] = ()) -> Optional[Backend]:
+        """Backend for the next query, or None if every node is unavailable.
+
+        A session sticks to the node that last answered it while that node is
+        healthy, since backends keep per-session memory. Otherwise the healthy
+        node with the lowest latency-weighted outstanding count wins; nodes
+        not known to be healthy are only tried when no healthy node is left.
+        """
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        with self._affinity_lock:
+            preferred = self._affinity.get(session_id)
+        if preferred in candidates and preferred.available and preferred.breaker.allow():
+            return preferred
+        available = sorted((b for b in candidates if b.available), key=Backend.score)
+        fallback = sorted((b for b in candidates if not b.available), key=Backend.score)
+        for backend in available + fallback:
+            if backend.breaker.allow():
+                return backend
+        return None
+
+    def assign(self, session_id: str, backend: Backend):
+        with self._affinity_lock:
+            self._affinity[session_id] = backend
+            self._affinity.move_to_end(session_id)
+            while len(self._affinity) > MAX_AFFINITY_SESSIONS:
+                self._affinity.popitem(last=False)
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
@@ -0,0 +1,246 @@
+"""End-to-end front-end benchmark against the local mock backend.
+
+Starts --backends instances of benchmarks/mock_backend.py in-process, points
+app.py at them through BIPP_API_BASE_URLS with a throwaway BIPP_STORAGE_DIR, and drives --users
+concurrent simulated users with streamlit.testing.v1.AppTest. Users in one
+process share the job manager, HTTP pool and SQLite store, as browser
+sessions on one Streamlit server do; --processes splits them across several
+app processes writing the same database, like multiple replicas.
+
+Reports script rerun latency, time to first backend event and to the
+finished answer (from the query_metrics table), end-to-end answer latency
+as seen by the polling user, and SQLite pool waits, transaction times and
+busy errors.
+
+    python benchmarks/bench_app.py --users 8 --queries 5 --first-event-delay 0.5 --drop-rate 0.1
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import storage  # noqa: E402
+from metrics import percentile  # noqa: E402
+from mock_backend import MockBackend, add_config_arguments, config_from_args  # noqa: E402
+
+APP_PATH = ROOT / "app.py"
+QUESTIONS = [
+    "Qual o faturamento total do último mês?",
+    "Quantos clientes ativos temos por região?",
+    "Mostre a tabela de vendas por região e mês",
+    "Qual produto teve a maior margem em 2024?",
+]
+
+
+class Samples:
+    """Thread-safe named lists of millisecond samples."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {}
+        self.counters = {}
+
+    def add(self, name: str, ms: float):
+        with self._lock:
+            self.values.setdefault(name, []).append(ms)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+
+@contextmanager
+def instrument_storage(samples: Samples):
+    """Time connection-pool waits and write transactions in storage.py."""
+    acquire = storage.SQLiteDatabase._acquire
+    transaction = storage.SQLiteDatabase.transaction
+
+    def timed_acquire(self):
+        start = time.perf_counter()
+        try:
+            return acquire(self)
+        finally:
+            samples.add("sqlite pool wait", (time.perf_counter() - start) * 1000)
+
+    @contextmanager
+    def timed_transaction(self):
+        start = time.perf_counter()
+        try:
+            with transaction(self) as conn:
+                yield conn
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                samples.count("sqlite busy errors")
+            raise
+        finally:
+            samples.add("sqlite transaction", (time.perf_counter() - start) * 1000)
+
+    storage.SQLiteDatabase._acquire = timed_acquire
+    storage.SQLiteDatabase.transaction = timed_transaction
+    try:
+        yield
+    finally:
+        storage.SQLiteDatabase._acquire = acquire
+        storage.SQLiteDatabase.transaction = transaction
+
+
+class SimulatedUser:
+    def __init__(self, user: int, args, samples: Samples, run_lock: threading.Lock):
+        self.user = user
+        self.args = args
+        self.samples = samples
+        self.run_lock = run_lock
+        self.at = AppTest.from_file(str(APP_PATH), default_timeout=args.timeout)
+
+    def run(self, name: str = "rerun"):
+        # AppTest swaps process-global runtime state around each script run,
+        # so runs are serialized; jobs, streaming and storage stay concurrent.
+        wait_start = time.perf_counter()
+        with self.run_lock:
+            start = time.perf_counter()
+            self.samples.add("rerun queue wait", (start - wait_start) * 1000)
+            self.at.run()
+            self.samples.add(name, (time.perf_counter() - start) * 1000)
+        if self.at.exception:
+            self.samples.count("script exceptions")
+
+    def session(self):
+        args = self.args
+        self.run("first load")
+        deadline = time.monotonic() + args.timeout
+        while self.at.session_state.api_status != "healthy" and time.monotonic() < deadline:
+            time.sleep(args.poll_interval)
+            self.run()
+
+        for i in range(args.queries):
+            question = QUESTIONS[(self.user + i) % len(QUESTIONS)]
+            if args.unique_queries:
+                question = f"{question} (usuário {self.user}, consulta {i})"
+            start = time.perf_counter()
+            self.at.chat_input[0].set_value(question)
+            self.run("submit rerun")
+            while self.at.session_state.is_processing and time.perf_counter() - start < args.timeout:
+                time.sleep(args.poll_interval)
+                self.run()
+            self.samples.add("answer visible", (time.perf_counter() - start) * 1000)
+            time.sleep(args.think_time)
+
+
+def run_users(user_ids, args, base_urls: str, storage_dir: str):
+    """Run ``user_ids`` concurrently in this process; returns raw samples."""
+    os.environ["BIPP_API_BASE_URLS"] = base_urls
+    os.environ["BIPP_STORAGE_DIR"] = storage_dir
+    if args.no_response_cache:
+        os.environ["BIPP_RESPONSE_CACHE"] = "0"
+    samples = Samples()
+    errors = []
+    run_lock = threading.Lock()
+
+    def target(user):
+        try:
+            SimulatedUser(user, args, samples, run_lock).session()
+        except Exception as e:  # keep the other users running
+            errors.append(f"user {user}: {e!r}")
+
+    with instrument_storage(samples):
+        threads = [threading.Thread(target=target, args=(user,)) for user in user_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Let the app's write-behind flusher persist the last messages and metrics
+        time.sleep(1)
+    return samples.values, samples.counters, errors
+
+
+def collect_query_metrics(db_path: Path, samples: Samples):
+    store = storage.SessionStore(db_path)
+    try:
+        for row in store.load_query_metrics():
+            samples.count(f"queries {row['status']}")
+            for field, name in (
+                ("connect_ms", "backend connect"),
+                ("first_event_ms", "first event"),
+                ("completed_ms", "answer completed"),
+                ("db_write_ms", "answer db write"),
+                ("render_ms", "answer render"),
+            ):
+                if row.get(field) is not None:
+                    samples.add(name, row[field])
+    finally:
+        store.close()
+
+
+def report(samples: Samples, mocks, elapsed: float):
+    print(f"\n{'':<22}{'n':>7}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'max ms':>11}")
+    for name, values in samples.values.items():
+        values.sort()
+        row = [percentile(values, q) for q in (0.5, 0.95, 0.99)] + [values[-1]]
+        print(f"{name:<22}{len(values):>7}" + "".join(f"{v:>11.1f}" for v in row))
+    print()
+    for name, n in sorted(samples.counters.items()):
+        print(f"{name:<22}{n:>7}")
+    for mock in mocks:
+        print(f"mock {mock.base_url:<17} {mock.stats.snapshot()}")
+    print(f"wall time              {elapsed:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--processes", type=int, default=1,
+                        help="split users across this many app processes sharing one database")
+    parser.add_argument("--backends", type=int, default=1, help="mock backend nodes to balance across")
+    parser.add_argument("--queries", type=int, default=3, help="queries per user")
+    parser.add_argument("--think-time", type=float, default=0.2, help="seconds between a user's queries")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="seconds between a waiting user's reruns")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--unique-queries", action="store_true", help="defeat the response cache")
+    parser.add_argument("--no-response-cache", action="store_true")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    mocks = [MockBackend(config=config_from_args(args)).start() for _ in range(args.backends)]
+    base_urls = ",".join(mock.base_url for mock in mocks)
+    samples = Samples()
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Mock backend on {base_urls}; {args.users} users x {args.queries} queries "
+              f"in {args.processes} process(es)")
+        groups = [list(range(args.users))[i::args.processes] for i in range(args.processes)]
+        start = time.perf_counter()
+        if args.processes == 1:
+            results = [run_users(groups[0], args, base_urls, tmp)]
+        else:
+            with multiprocessing.get_context("spawn").Pool(args.processes) as pool:
+                results = pool.starmap(run_users, [(group, args, base_urls, tmp) for group in groups])
+        elapsed = time.perf_counter() - start
+
+        for values, counters, group_errors in results:
+            for name, group_values in values.items():
+                samples.values.setdefault(name, []).extend(group_values)
+            for name, n in counters.items():
+                samples.count(name, n)
+            errors.extend(group_errors)
+        collect_query_metrics(Path(tmp) / "sessions.db", samples)
+        report(samples, mocks, elapsed)
+    for error in errors:
+        print(error)
+    for mock in mocks:
+        mock.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Session storage benchmark.
+
+Builds a throwaway database with --sessions sessions and --messages messages,
+then times the sidebar session list and per-session message loads on the
+pre-index schema (version 1) and again after running the remaining migrations.
+
+    python benchmarks/bench_storage.py --sessions 10000 --messages 1000000
+"""
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from storage import SCHEMA_VERSION, SessionStore, migrate  # noqa: E402
+
+
+class PreIndexStore(SessionStore):
+    """Store that stops at schema version 1, before the indexes were added."""
+
+    migrated = False
+
+    def init_schema(self):
+        with self.connection() as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            migrate(conn, target_version=1)
+
+    def load_session_messages(self, session_id: str, limit: int = None, before_id: int = None):
+        if self.migrated:
+            return super().load_session_messages(session_id, limit, before_id)
+        # The current query reads columns and tables added after version 1
+        with self.connection() as conn:
+            return conn.execute(
+                "SELECT id, role, content, timestamp FROM messages WHERE session_id = ? ORDER BY id ASC",
+                (session_id,)
+            ).fetchall()
+
+
+def populate(store: SessionStore, n_sessions: int, n_messages: int, batch: int = 50_000):
+    session_ids = [str(uuid.uuid4()) for _ in range(n_sessions)]
+    with store.transaction() as conn:
+        conn.executemany(
+            """
+            INSERT INTO sessions (session_id, session_name, last_activity)
+            VALUES (?, ?, datetime('now', ?))
+            """,
+            (
+                (sid, f"Sessão {i}", f"-{random.randint(0, 86_400 * 90)} seconds")
+                for i, sid in enumerate(session_ids)
+            ),
+        )
+    content = "SELECT * FROM vendas WHERE data >= '2024-01-01' " * 4
+    written = 0
+    while written < n_messages:
+        size = min(batch, n_messages - written)
+        with store.transaction() as conn:
+            conn.executemany(
+                """
+                INSERT INTO messages (session_id, role, content, timestamp)
+                VALUES (?, ?, ?, ?)
+                """,
+                (
+                    (random.choice(session_ids), "user" if i % 2 else "assistant", content, "12:00:00")
+                    for i in range(size)
+                ),
+            )
+        written += size
+    return session_ids
+
+
+def timed(fn, samples: int):
+    durations = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    return {
+        "p50": statistics.median(durations),
+        "p95": durations[max(0, int(len(durations) * 0.95) - 1)],
+        "max": durations[-1],
+    }
+
+
+def report(label: str, stats: dict):
+    print(f"  {label:<28} p50 {stats['p50']:8.2f} ms   p95 {stats['p95']:8.2f} ms   max {stats['max']:8.2f} ms")
+
+
+def run_queries(store: SessionStore, session_ids, samples: int):
+    report("get_all_sessions", timed(store.get_all_sessions, max(3, samples // 10)))
+    report(
+        "load_session_messages",
+        timed(lambda: store.load_session_messages(random.choice(session_ids)), samples),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10_000)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "sessions.db"
+        store = PreIndexStore(db_path)
+
+        start = time.perf_counter()
+        session_ids = populate(store, args.sessions, args.messages)
+        print(f"Populated {args.sessions} sessions / {args.messages} messages in {time.perf_counter() - start:.1f}s")
+
+        print("Schema v1 (no indexes):")
+        run_queries(store, session_ids, args.samples)
+
+        start = time.perf_counter()
+        with store.connection() as conn:
+            migrate(conn)
+        store.migrated = True
+        print(f"Migrated to v{SCHEMA_VERSION} in {time.perf_counter() - start:.1f}s")
+
+        print(f"Schema v{SCHEMA_VERSION}:")
+        run_queries(store, session_ids, args.samples)
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""Local stand-in for the analytics backend.
+
+Implements /health, /models, /clear-session/{id}, /cancel/{id}, /warm-up/{id}
+and the streaming /sql-query SSE endpoint with configurable latency, chunking and fault injection, so the
+front end can be exercised and benchmarked offline. The first query of a
+session that was not warmed up waits an extra --cold-start-delay.
+
+    python benchmarks/mock_backend.py --port 8000 --first-event-delay 0.5 --error-rate 0.05
+    BIPP_API_BASE_URL=http://127.0.0.1:8000 streamlit run app.py
+
+Queries containing "tabela" also get a result table of --result-rows rows.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+MODELS = {
+    "openai": ["gpt-4o-mini", "gpt-4o"],
+    "anthropic": ["claude-3-5-haiku", "claude-3-5-sonnet"],
+}
+
+
+@dataclass
+class MockConfig:
+    first_event_delay: float = 0.3
+    cold_start_delay: float = 0.0
+    chunk_delay: float = 0.05
+    chunk_chars: int = 16
+    answer_chars: int = 400
+    result_rows: int = 100
+    # Fault injection, as probabilities per /sql-query request
+    http_error_rate: float = 0.0
+    error_rate: float = 0.0
+    drop_rate: float = 0.0
+    health_delay: float = 0.0
+    seed: Optional[int] = None
+
+
+@dataclass
+class MockStats:
+    queries: int = 0
+    active: int = 0
+    peak_active: int = 0
+    http_errors: int = 0
+    stream_errors: int = 0
+    drops: int = 0
+    resumes: int = 0
+    cancels: int = 0
+    warmups: int = 0
+    cold_starts: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+            self.peak_active = max(self.peak_active, self.active)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {name: value for name, value in vars(self).items() if not name.startswith("_")}
+
+
+def build_events(query: str, model_id: str, config: MockConfig) -> List[dict]:
+    """The full event sequence for one query; deterministic so resumes replay it."""
+    sentence = f"Resposta simulada de {model_id} para: {query}. "
+    answer = (sentence * (config.answer_chars // len(sentence) + 1))[:config.answer_chars]
+    step = max(1, config.chunk_chars)
+    events = [
+        {"status": "processing", "message": "Gerando SQL"},
+        {"status": "processing", "message": "Executando consulta"},
+    ]
+    events += [{"status": "streaming", "delta": answer[i:i + step]} for i in range(0, len(answer), step)]
+    completed = {"status": "completed", "reasoning": answer}
+    if "tabela" in query and config.result_rows:
+        regions = ["Norte", "Nordeste", "Centro-Oeste", "Sudeste", "Sul"]
+        completed["result"] = {
+            "columns": ["regiao", "mes", "total"],
+            "rows": [[regions[i % 5], f"2024-{i % 12 + 1:02d}", round(i * 1.5, 2)] for i in range(config.result_rows)],
+        }
+    events.append(completed)
+    return events
+
+
+class MockBackendHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def config(self) -> MockConfig:
+        return self.server.config
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, obj, status: int = 200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return {}
+
+    def do_GET(self):
+        if self.path == "/health":
+            time.sleep(self.config.health_delay)
+            self._send_json({"status": "healthy", "active_queries": self.server.stats.active})
+        elif self.path == "/models":
+            self._send_json({"models": MODELS})
+        else:
+            self._send_json({"detail": "Not Found"}, status=404)
+
+    def do_POST(self):
+        body = self._read_json()
+        if self.path.startswith("/clear-session/"):
+            self._send_json({"status": "success", "session_id": self.path.rsplit("/", 1)[-1]})
+        elif self.path.startswith("/cancel/"):
+            session_id = self.path.rsplit("/", 1)[-1]
+            self._send_json({"status": "success", "cancelled": self.server.cancel(session_id)})
+        elif self.path.startswith("/warm-up/"):
+            self.server.stats.add(warmups=1)
+            self.server.warm(self.path.rsplit("/", 1)[-1])
+            self._send_json({"status": "success", "model_id": body.get("model_id")})
+        elif self.path == "/sql-query":
+            self._stream_query(body)
+        else:
+            self._send_json({"detail": "Not Found"}, status=404)
+
+    def _stream_query(self, body: dict):
+        stats, roll = self.server.stats, self.server.roll
+        stats.add(queries=1)
+        if roll(self.config.http_error_rate):
+            stats.add(http_errors=1)
+            self._send_json({"detail": "Serviço indisponível"}, status=503)
+            return
+
+        events = build_events(body.get("query", ""), body.get("model_id", ""), self.config)
+        last_id = self.headers.get("Last-Event-ID")
+        start = int(last_id) + 1 if last_id and last_id.isdigit() else 0
+        if start:
+            stats.add(resumes=1)
+        fail_at = random.Random(body.get("query")).randrange(2, len(events))
+        inject_error = not start and roll(self.config.error_rate)
+        inject_drop = not start and not inject_error and roll(self.config.drop_rate)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        stats.add(active=1)
+        cancelled = self.server.register(body.get("session_id"))
+        first_event_delay = self.config.first_event_delay
+        if not self.server.warm(body.get("session_id")):
+            stats.add(cold_starts=1)
+            first_event_delay += self.config.cold_start_delay
+        try:
+            if cancelled.wait(first_event_delay):
+                return self._abort()
+            for event_id in range(start, len(events)):
+                if event_id == fail_at and inject_error:
+                    stats.add(stream_errors=1)
+                    self._write_event({"status": "error", "error": "Falha simulada no backend"})
+                    break
+                if event_id == fail_at and inject_drop:
+                    # Close without the terminating chunk, like a dropped connection
+                    stats.add(drops=1)
+                    self.close_connection = True
+                    return
+                self._write_event(events[event_id], event_id)
+                if events[event_id]["status"] == "streaming" and cancelled.wait(self.config.chunk_delay):
+                    return self._abort()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away (e.g. cancelled or timed out)
+            self.close_connection = True
+        finally:
+            self.server.unregister(body.get("session_id"), cancelled)
+            stats.add(active=-1)
+
+    def _abort(self):
+        self.server.stats.add(cancels=1)
+        self.close_connection = True
+
+    def _write_event(self, data: dict, event_id: Optional[int] = None):
+        frame = f"data: {json.dumps(data, ensure_ascii=False)}\n"
+        if event_id is not None:
+            frame = f"id: {event_id}\n" + frame
+        payload = (frame + "\n").encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+        self.wfile.flush()
+
+
+class MockBackend(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), config: MockConfig = None, verbose: bool = False):
+        super().__init__(address, MockBackendHandler)
+        self.config = config or MockConfig()
+        self.verbose = verbose
+        self.stats = MockStats()
+        self._rng = random.Random(self.config.seed)
+        self._rng_lock = threading.Lock()
+        self._streams = {}
+        self._streams_lock = threading.Lock()
+        self._warm_sessions = set()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is expected
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def register(self, session_id: str) -> threading.Event:
+        cancelled = threading.Event()
+        with self._streams_lock:
+            self._streams.setdefault(session_id, set()).add(cancelled)
+        return cancelled
+
+    def unregister(self, session_id: str, cancelled: threading.Event):
+        with self._streams_lock:
+            self._streams.get(session_id, set()).discard(cancelled)
+
+    def cancel(self, session_id: str) -> int:
+        with self._streams_lock:
+            streams = self._streams.pop(session_id, set())
+        for cancelled in streams:
+            cancelled.set()
+        return len(streams)
+
+    def warm(self, session_id: str) -> bool:
+        """Mark a session's memory as built; returns whether it already was."""
+        with self._streams_lock:
+            if session_id in self._warm_sessions:
+                return True
+            self._warm_sessions.add(session_id)
+            return False
+
+    def roll(self, probability: float) -> bool:
+        if probability <= 0:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < probability
+
+    def start(self) -> "MockBackend":
+        threading.Thread(target=self.serve_forever, name="mock-backend", daemon=True).start()
+        return self
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    defaults = MockConfig()
+    parser.add_argument("--first-event-delay", type=float, default=defaults.first_event_delay,
+                        help="seconds before the first SSE event")
+    parser.add_argument("--cold-start-delay", type=float, default=defaults.cold_start_delay,
+                        help="extra seconds before the first event of a session that was not warmed up")
+    parser.add_argument("--chunk-delay", type=float, default=defaults.chunk_delay,
+                        help="seconds between streamed deltas")
+    parser.add_argument("--chunk-chars", type=int, default=defaults.chunk_chars)
+    parser.add_argument("--answer-chars", type=int, default=defaults.answer_chars)
+    parser.add_argument("--result-rows", type=int, default=defaults.result_rows)
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="share of queries answered with HTTP 503")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of streams ending in an error event")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="share of streams dropped mid-response")
+    parser.add_argument("--health-delay", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args) -> MockConfig:
+    return MockConfig(
+        first_event_delay=args.first_event_delay,
+        cold_start_delay=args.cold_start_delay,
+        chunk_delay=args.chunk_delay,
+        chunk_chars=args.chunk_chars,
+        answer_chars=args.answer_chars,
+        result_rows=args.result_rows,
+        http_error_rate=args.http_error_rate,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        health_delay=args.health_delay,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--verbose", action="store_true")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockBackend((args.host, args.port), config_from_args(args), verbose=args.verbose)
+    print(f"Mock backend listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(server.stats.snapshot())
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
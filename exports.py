@@ -0,0 +1,103 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from storage import ResultBlob
+
+EXPORT_FORMATS = ("csv", "parquet")
+
+# Rows converted per batch when writing CSV; bounds export memory to roughly
+# one batch plus the compressed Parquet blob.
+EXPORT_BATCH_ROWS = 64 * 1024
+
+# Streamlit refuses to serve app static files above 200 MB; bigger CSV
+# exports are written gzip-compressed instead, and exports that are still
+# too big are refused.
+MAX_STATIC_FILE_BYTES = 200 * 1024 * 1024
+
+
+class ExportTooLargeError(ValueError):
+    pass
+
+
+def export_path(export_dir: Path, result_id: str, fmt: str) -> Optional[Path]:
+    for suffix in ((".csv", ".csv.gz") if fmt == "csv" else (".parquet",)):
+        path = export_dir / f"{result_id}{suffix}"
+        if path.exists():
+            return path
+    return None
+
+
+def export_result(blob: ResultBlob, fmt: str, export_dir: Path) -> Path:
+    """Write a stored result set to ``export_dir`` and return the file path.
+
+    Results are immutable, so an existing export is reused. Parquet exports
+    are the stored blob itself; CSV is streamed batch by batch from it.
+    Raises ExportTooLargeError if the file would be too big to serve.
+    """
+    export_dir.mkdir(parents=True, exist_ok=True)
+    existing = export_path(export_dir, blob.result_id, fmt)
+    if existing is not None:
+        os.utime(existing)
+        return existing
+    if fmt == "parquet":
+        path = _atomic_write(export_dir / f"{blob.result_id}.parquet", lambda f: f.write(blob.payload))
+    elif fmt == "csv":
+        path = (
+            _atomic_write(export_dir / f"{blob.result_id}.csv", lambda f: _write_csv(blob, f))
+            or _atomic_write(export_dir / f"{blob.result_id}.csv.gz", lambda f: _write_csv_gz(blob, f))
+        )
+    else:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    if path is None:
+        raise ExportTooLargeError(f"{fmt} export of {blob.result_id} exceeds {MAX_STATIC_FILE_BYTES} bytes")
+    return path
+
+
+def _write_csv(blob: ResultBlob, sink):
+    parquet_file = pq.ParquetFile(pa.BufferReader(blob.payload))
+    with pa_csv.CSVWriter(sink, parquet_file.schema_arrow) as writer:
+        for batch in parquet_file.iter_batches(batch_size=EXPORT_BATCH_ROWS):
+            writer.write_batch(batch)
+
+
+def _write_csv_gz(blob: ResultBlob, f):
+    with pa.CompressedOutputStream(f, "gzip") as stream:
+        _write_csv(blob, stream)
+
+
+def _atomic_write(path: Path, write) -> Optional[Path]:
+    """Write ``path`` through a uniquely named temporary file, so a
+    half-written file is never served and concurrent exports of the same
+    result do not collide. Returns None, keeping nothing, if the file
+    would be too big to serve."""
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.", suffix=".part", delete=False) as f:
+        try:
+            write(f)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    if os.path.getsize(f.name) > MAX_STATIC_FILE_BYTES:
+        os.unlink(f.name)
+        return None
+    os.replace(f.name, path)
+    return path
+
+
+def purge_exports(export_dir: Path, max_age: float):
+    if not export_dir.exists():
+        return
+    cutoff = time.time() - max_age
+    for path in export_dir.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,92 @@
+import socket
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts in seconds per backend endpoint. For streamed
+# responses the read timeout bounds the gap between chunks (the idle or
+# heartbeat timeout), not the total.
+TIMEOUTS = {
+    "health": (3.05, 5),
+    "models": (3.05, 10),
+    "clear_session": (3.05, 10),
+    "cancel": (3.05, 5),
+    "warmup": (3.05, 10),
+    "sql_query": (3.05, 60),
+}
+
+# Upper bound for a whole /sql-query stream, including resumed connections
+SQL_QUERY_DEADLINE = 300
+
+# Only idempotent methods are retried; a POST to /sql-query must never be
+# silently re-executed.
+RETRYABLE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+RETRYABLE_STATUSES = (502, 503, 504)
+
+
+def build_session(pool_size: int = 32, retries: int = 2, backoff_factor: float = 0.3) -> requests.Session:
+    """Shared keep-alive session with a sized connection pool and bounded retries."""
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRYABLE_STATUSES,
+        allowed_methods=RETRYABLE_METHODS,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+def abort_response(response: requests.Response):
+    """Interrupt a thread blocked reading a streamed response.
+
+    Response.close() does not wake a blocking read, so the socket itself is
+    shut down; the reader then fails with a connection error.
+    """
+    sock = getattr(getattr(response.raw, "connection", None), "sock", None)
+    if sock is None:
+        response.close()
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class CancelToken:
+    """Cancels a streamed request from another thread.
+
+    The streaming code attaches each response it opens; ``cancel`` aborts the
+    attached response, and one attached after cancellation is aborted at once.
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._response: Optional[requests.Response] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def attach(self, response: requests.Response):
+        with self._lock:
+            self._response = response
+            if self.cancelled:
+                abort_response(response)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled.set()
+            if self._response is not None:
+                abort_response(self._response)
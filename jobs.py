@@ -0,0 +1,247 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional
+
+from http_client import SQL_QUERY_DEADLINE, CancelToken
+from metrics import QueryTimer
+from response_cache import ResponseCache
+from results import RESULT_FORMAT, encode_table, new_result_id, table_from_payload
+from storage import BaseSessionStore, ResultBlob
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "error"
+INTERRUPTED = "interrupted"
+CANCELLED = "cancelled"
+
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# Finished jobs stay in memory this long so the browser can pick up the result
+FINISHED_JOB_TTL = 600
+
+# A job still active this long after it was created cannot be running
+# anywhere; every replica checks for such jobs this often and fails them, as
+# the replica that ran them may never come back under the same worker name
+STALE_JOB_AGE = 2 * SQL_QUERY_DEADLINE
+STALE_JOB_SWEEP_INTERVAL = 60
+
+TIMEOUT_MESSAGE = "**Timeout:** A consulta demorou muito para responder."
+INTERRUPTED_MESSAGE = "**Erro:** A consulta foi interrompida pelo reinício do servidor."
+CANCELLED_MESSAGE = "*Consulta interrompida pelo usuário.*"
+
+
+@dataclass
+class Job:
+    job_id: str
+    session_id: str
+    prompt: str
+    model_id: str
+    assistant_ts: str
+    status: str = QUEUED
+    status_message: str = "Processando sua consulta..."
+    partial: str = ""
+    content: Optional[str] = None
+    result: Optional[object] = None  # pyarrow.Table
+    result_id: Optional[str] = None
+    group_id: Optional[str] = None
+    cancel_token: CancelToken = field(default_factory=CancelToken)
+    timer: QueryTimer = field(default_factory=QueryTimer)
+    created_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status not in ACTIVE_STATUSES
+
+    @property
+    def elapsed_ms(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return (end - self.timer.started) * 1000
+
+
+class JobManager:
+    """Runs queries on a bounded worker pool and persists their answers.
+
+    Workers consume the backend stream and write the assistant message to the
+    store themselves, so an answer is kept even if the browser that asked for
+    it has gone away. Live progress (status text, partial answer) is kept in
+    memory for the UI to poll.
+    """
+
+    def __init__(
+        self,
+        store: BaseSessionStore,
+        stream: Callable[[str, str, str, QueryTimer, CancelToken], Iterator[dict]],
+        max_workers: int = 8,
+        response_cache: Optional[ResponseCache] = None,
+    ):
+        self.store = store
+        self.response_cache = response_cache
+        self._stream = stream
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bipp-query")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        # Anything of ours still queued/running in the table was lost with a previous process
+        self._fail_lost_jobs(own=True)
+        threading.Thread(target=self._sweep_lost_jobs, name="bipp-job-sweeper", daemon=True).start()
+
+    def submit(
+        self,
+        session_id: str,
+        prompt: str,
+        model_id: str,
+        assistant_ts: str,
+        group_id: Optional[str] = None,
+    ) -> Job:
+        """Queue a query; jobs submitted with the same ``group_id`` answer one
+        prompt with different models and run concurrently."""
+        job = Job(str(uuid.uuid4()), session_id, prompt, model_id, assistant_ts, group_id=group_id)
+        self.store.create_job(job.job_id, session_id, prompt, model_id, assistant_ts, group_id)
+        with self._lock:
+            self._prune()
+            self._jobs[job.job_id] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Stop a job: its stream is aborted and whatever was received so far
+        is saved as the answer."""
+        job = self.get(job_id)
+        if job is None or job.done:
+            return None
+        with self._lock:
+            job.cancel_token.cancel()
+            queued = job.status == QUEUED
+        if queued:
+            # Never picked up by a worker; _run will skip it
+            self._finish(job, CANCELLED, CANCELLED_MESSAGE)
+        return job
+
+    def running_job(self, session_id: str) -> Optional[Job]:
+        with self._lock:
+            for job in self._jobs.values():
+                if job.session_id == session_id and not job.done:
+                    return job
+        return None
+
+    def running_jobs(self, session_id: str) -> List[Job]:
+        with self._lock:
+            return [job for job in self._jobs.values() if job.session_id == session_id and not job.done]
+
+    def _fail_lost_jobs(self, own: bool):
+        stale_before = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - STALE_JOB_AGE))
+        self.store.fail_active_jobs(INTERRUPTED, INTERRUPTED_MESSAGE, stale_before, own=own)
+
+    def _sweep_lost_jobs(self):
+        while True:
+            time.sleep(STALE_JOB_SWEEP_INTERVAL)
+            try:
+                self._fail_lost_jobs(own=False)
+            except Exception:
+                logger.exception("Could not fail lost jobs")
+
+    def _prune(self):
+        cutoff = time.monotonic() - FINISHED_JOB_TTL
+        for job_id in [j.job_id for j in self._jobs.values() if j.done and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def _run(self, job: Job):
+        with self._lock:
+            if job.cancel_token.cancelled:
+                return
+            job.status = RUNNING
+        timer = job.timer
+        timer.mark("started")
+        status, content = FAILED, TIMEOUT_MESSAGE
+        try:
+            for chunk in self._stream(job.prompt, job.session_id, job.model_id, timer, job.cancel_token):
+                if job.cancel_token.cancelled:
+                    break
+                timer.mark_once("first_event")
+                if chunk.get('status') == 'processing':
+                    job.status_message = chunk.get('message', 'Processando...')
+                    timer.mark(f"processing:{job.status_message}")
+                elif chunk.get('status') == 'streaming':
+                    # Partial answer: either an incremental delta or the full text so far
+                    if 'content' in chunk:
+                        job.partial = chunk['content']
+                    else:
+                        job.partial += chunk.get('delta', '')
+                elif chunk.get('status') == 'result':
+                    self._set_result(job, chunk.get('result'))
+                elif chunk.get('status') == 'completed':
+                    timer.mark("completed")
+                    status = COMPLETED
+                    content = chunk.get('reasoning') or job.partial or 'Nenhuma resposta recebida'
+                    if chunk.get('result'):
+                        self._set_result(job, chunk['result'])
+                    break
+                elif chunk.get('status') == 'error':
+                    content = f"**Erro:** {chunk.get('error', 'Erro desconhecido')}"
+                    break
+        except Exception as e:
+            content = f"**Erro inesperado:** {str(e)}"
+        finally:
+            if job.cancel_token.cancelled and status != COMPLETED:
+                status = CANCELLED
+                content = f"{job.partial}\n\n{CANCELLED_MESSAGE}" if job.partial else CANCELLED_MESSAGE
+            self._finish(job, status, content)
+
+    def _finish(self, job: Job, status: str, content: str):
+        job.content = content
+        try:
+            result = self._encode_result(job) if status == COMPLETED else None
+            with job.timer.measure("db_write"):
+                self.store.finish_job(job.job_id, job.session_id, status, content, job.assistant_ts, result)
+            self._save_metrics(job, status)
+            # Only text answers are cached; result sets stay with their session
+            if status == COMPLETED and result is None and self.response_cache is not None:
+                self.response_cache.put(job.prompt, job.model_id, content)
+        finally:
+            job.finished_at = time.monotonic()
+            job.status = status
+
+    def _set_result(self, job: Job, payload):
+        if not isinstance(payload, dict):
+            return
+        try:
+            job.result = table_from_payload(payload)
+        except Exception:
+            logger.exception("Ignoring malformed result payload for job %s", job.job_id)
+
+    def _encode_result(self, job: Job) -> Optional[ResultBlob]:
+        if job.result is None:
+            return None
+        try:
+            blob = ResultBlob(new_result_id(), RESULT_FORMAT, job.result.num_rows, encode_table(job.result))
+        except Exception:
+            logger.exception("Could not encode result set for job %s", job.job_id)
+            return None
+        job.result_id = blob.result_id
+        job.result = None
+        return blob
+
+    def _save_metrics(self, job: Job, status: str):
+        timer = job.timer
+        self.store.save_query_metrics({
+            "job_id": job.job_id,
+            "session_id": job.session_id,
+            "model_id": job.model_id,
+            "status": status,
+            "connect_ms": timer.offset("connect"),
+            "first_event_ms": timer.offset("first_event"),
+            "completed_ms": timer.offset("completed"),
+            "db_write_ms": timer.durations.get("db_write"),
+            "total_ms": round(timer.elapsed_ms(), 2),
+            "stages": timer.stages,
+        })
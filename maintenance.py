@@ -0,0 +1,324 @@
+"""Retention, archival and compaction for the session store.
+
+Sessions idle for longer than the retention policy allows are archived: their
+messages and result sets move to one compressed JSON Lines file per session
+(zstd if the zstandard package is installed, gzip otherwise) and are put back
+transparently when the session is opened again. With PostgreSQL, which
+several replicas share, the compressed archives are kept in the database
+instead of on one replica's disk. Older sessions, jobs and
+metrics can be deleted outright, and freed pages returned to the filesystem.
+Expired answers are also purged from the response cache.
+
+    python -m maintenance --archive-after-days 30 --delete-after-days 365 --vacuum
+    python -m maintenance --dry-run
+    python -m maintenance --database-url postgresql://bipp@db/bipp --delete-after-days 365
+"""
+import argparse
+import base64
+import gzip
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+try:
+    import zstandard
+except ImportError:  # optional; archives are written with gzip instead
+    zstandard = None
+
+from response_cache import ResponseCache
+from storage import BaseSessionStore, open_session_store
+
+logger = logging.getLogger(__name__)
+
+STORAGE_DIR = Path(os.environ.get("BIPP_STORAGE_DIR", "streamlit_storage"))
+# Same defaults as the app's response cache
+RESPONSE_CACHE_DB = STORAGE_DIR / "response_cache.db"
+RESPONSE_CACHE_TTL = int(os.environ.get("BIPP_RESPONSE_CACHE_TTL", 6 * 3600))
+
+ZSTD_SUFFIX = ".jsonl.zst"
+GZIP_SUFFIX = ".jsonl.gz"
+ZSTD_LEVEL = 10
+
+DAY = 86400
+
+
+@dataclass
+class RetentionPolicy:
+    """Age limits are in days of inactivity; None disables a limit."""
+    archive_after_days: Optional[float] = 30
+    max_active_sessions: Optional[int] = None
+    delete_after_days: Optional[float] = None
+    max_sessions: Optional[int] = None
+    history_days: Optional[float] = 90
+
+
+def utc_cutoff(days: Optional[float], now: Optional[float] = None) -> str:
+    """``days`` ago in the sessions table's timestamp format; with no limit,
+    a time before any session."""
+    if days is None:
+        return "0001-01-01 00:00:00"
+    now = time.time() if now is None else now
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - days * DAY))
+
+
+def encode_archive(session: dict, messages: List[dict], results: List[dict]) -> Tuple[str, bytes]:
+    """Compressed JSON Lines for one session and the suffix naming its
+    compression. The first line is the session row, then one line per
+    message and per result set (with its payload base64-encoded)."""
+    records = [{"type": "session", **session}]
+    records += [{"type": "message", **message} for message in messages]
+    records += [
+        {"type": "result", **result, "payload": base64.b64encode(result["payload"]).decode("ascii")}
+        for result in results
+    ]
+    data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+    if zstandard is not None:
+        return ZSTD_SUFFIX, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return GZIP_SUFFIX, gzip.compress(data)
+
+
+def decode_archive(suffix: str, data: bytes) -> Tuple[dict, List[dict], List[dict]]:
+    if suffix == ZSTD_SUFFIX:
+        if zstandard is None:
+            raise RuntimeError("Archive is zstd-compressed; install the zstandard package to read it")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        data = gzip.decompress(data)
+
+    session, messages, results = None, [], []
+    for line in data.decode("utf-8").splitlines():
+        record = json.loads(line)
+        kind = record.pop("type")
+        if kind == "session":
+            session = record
+        elif kind == "message":
+            messages.append(record)
+        elif kind == "result":
+            record["payload"] = base64.b64decode(record["payload"])
+            results.append(record)
+    return session, messages, results
+
+
+class SessionArchive:
+    """One compressed JSON Lines file per archived session (see
+    encode_archive)."""
+
+    def __init__(self, archive_dir: Path):
+        self.archive_dir = Path(archive_dir)
+
+    def path(self, session_id: str) -> Optional[Path]:
+        _check_session_id(session_id)
+        for suffix in (ZSTD_SUFFIX, GZIP_SUFFIX):
+            path = self.archive_dir / f"{session_id}{suffix}"
+            if path.exists():
+                return path
+        return None
+
+    def write(self, session: dict, messages: List[dict], results: List[dict]) -> Path:
+        _check_session_id(session["session_id"])
+        suffix, data = encode_archive(session, messages, results)
+
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        path = self.archive_dir / f"{session['session_id']}{suffix}"
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            # The database rows are deleted right after this returns
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return path
+
+    def read(self, session_id: str) -> Tuple[dict, List[dict], List[dict]]:
+        path = self.path(session_id)
+        if path is None:
+            raise FileNotFoundError(f"No archive for session {session_id}")
+        suffix = ZSTD_SUFFIX if path.name.endswith(ZSTD_SUFFIX) else GZIP_SUFFIX
+        return decode_archive(suffix, path.read_bytes())
+
+    def delete(self, session_id: str):
+        path = self.path(session_id)
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+
+class DatabaseArchive:
+    """Archives kept in the session database, for stores shared by several
+    replicas (stores_archives); same format as SessionArchive's files."""
+
+    def __init__(self, store: BaseSessionStore):
+        self.store = store
+
+    def write(self, session: dict, messages: List[dict], results: List[dict]):
+        suffix, data = encode_archive(session, messages, results)
+        self.store.save_archive(session["session_id"], suffix, data)
+
+    def read(self, session_id: str) -> Tuple[dict, List[dict], List[dict]]:
+        archive = self.store.load_archive(session_id)
+        if archive is None:
+            raise FileNotFoundError(f"No archive for session {session_id}")
+        return decode_archive(*archive)
+
+    def delete(self, session_id: str):
+        self.store.delete_archive(session_id)
+
+
+Archive = Union[SessionArchive, DatabaseArchive]
+
+
+def open_archive(store: BaseSessionStore, archive_dir: Path) -> Archive:
+    """Where ``store`` keeps its archived sessions."""
+    return DatabaseArchive(store) if store.stores_archives else SessionArchive(archive_dir)
+
+
+def _check_session_id(session_id: str):
+    # Session ids become file names
+    if not session_id or Path(session_id).name != session_id or session_id.startswith("."):
+        raise ValueError(f"Invalid session id: {session_id!r}")
+
+
+def archive_session(store: BaseSessionStore, archive: Archive, session_id: str) -> bool:
+    return store.archive_session(session_id, archive.write)
+
+
+def rehydrate_session(store: BaseSessionStore, archive: Archive, session_id: str) -> bool:
+    """Move an archived session's messages back into the store. Returns
+    False if the session is not archived."""
+    if not store.is_archived(session_id):
+        return False
+    _, messages, results = archive.read(session_id)
+    store.restore_session(session_id, messages, results)
+    archive.delete(session_id)
+    return True
+
+
+def delete_sessions(store: BaseSessionStore, archive: Archive, session_ids: List[str]):
+    for session_id in session_ids:
+        store.delete_session(session_id)
+        archive.delete(session_id)
+
+
+def run_maintenance(
+    store: BaseSessionStore,
+    archive: Archive,
+    policy: RetentionPolicy,
+    vacuum: bool = False,
+    full_vacuum: bool = False,
+    dry_run: bool = False,
+    response_cache: Optional[ResponseCache] = None,
+) -> Dict[str, object]:
+    """Apply ``policy`` once: delete, then archive, then purge old jobs,
+    metrics and expired cached answers, then optionally reclaim free pages."""
+    now = time.time()
+    report: Dict[str, object] = {"before": store.space_stats()}
+
+    to_delete = []
+    if policy.delete_after_days is not None or policy.max_sessions is not None:
+        to_delete = store.sessions_to_delete(utc_cutoff(policy.delete_after_days, now), policy.max_sessions)
+    to_archive = []
+    if policy.archive_after_days is not None or policy.max_active_sessions is not None:
+        deleting = set(to_delete)
+        to_archive = [
+            session_id
+            for session_id in store.sessions_to_archive(
+                utc_cutoff(policy.archive_after_days, now), policy.max_active_sessions
+            )
+            if session_id not in deleting
+        ]
+    report["deleted"] = len(to_delete)
+    report["archived"] = len(to_archive)
+    if dry_run:
+        report["delete"], report["archive"] = to_delete, to_archive
+        return report
+
+    delete_sessions(store, archive, to_delete)
+    archived = 0
+    for session_id in to_archive:
+        try:
+            archived += archive_session(store, archive, session_id)
+        except Exception:
+            # Leave the session in the database; the next run retries it
+            logger.exception("Could not archive session %s", session_id)
+    report["archived"] = archived
+
+    if policy.history_days is not None:
+        report["purged"] = store.purge_history(utc_cutoff(policy.history_days, now), now - policy.history_days * DAY)
+    if response_cache is not None:
+        report["cache_purged"] = response_cache.purge_expired()
+
+    if full_vacuum:
+        store.compact()
+    elif vacuum:
+        if store.space_stats().get("auto_vacuum") == "none":
+            logger.warning("auto_vacuum is off for %s; run with --full-vacuum once to enable it", store.db_path)
+        report["pages_freed"] = store.reclaim_space()
+        store.checkpoint()
+        if response_cache is not None:
+            response_cache.reclaim_space()
+            response_cache.checkpoint()
+    report["after"] = store.space_stats()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    defaults = RetentionPolicy()
+    parser.add_argument("--db", type=Path, default=STORAGE_DIR / "sessions.db")
+    parser.add_argument("--database-url", default=os.environ.get("BIPP_DATABASE_URL"),
+                        help="PostgreSQL URL; overrides --db")
+    parser.add_argument("--archive-dir", type=Path, default=STORAGE_DIR / "archive",
+                        help="archive files for SQLite; PostgreSQL keeps archives in the database")
+    parser.add_argument("--archive-after-days", type=float, default=defaults.archive_after_days,
+                        help="archive sessions idle for longer than this")
+    parser.add_argument("--max-active-sessions", type=int, default=defaults.max_active_sessions,
+                        help="archive all but this many most recent sessions")
+    parser.add_argument("--delete-after-days", type=float, default=defaults.delete_after_days,
+                        help="delete sessions (and their archives) idle for longer than this")
+    parser.add_argument("--max-sessions", type=int, default=defaults.max_sessions,
+                        help="delete all but this many most recent sessions")
+    parser.add_argument("--history-days", type=float, default=defaults.history_days,
+                        help="keep finished jobs and query metrics for this many days")
+    parser.add_argument("--response-cache", type=Path, default=RESPONSE_CACHE_DB,
+                        help="response cache to purge of expired answers (skipped if missing)")
+    parser.add_argument("--response-cache-ttl", type=int, default=RESPONSE_CACHE_TTL,
+                        help="age in seconds after which cached answers expire")
+    parser.add_argument("--no-archive", action="store_true", help="skip archiving")
+    parser.add_argument("--vacuum", action="store_true", help="return free pages to the filesystem")
+    parser.add_argument("--full-vacuum", action="store_true",
+                        help="rebuild the file with VACUUM (enables incremental auto_vacuum on old files)")
+    parser.add_argument("--dry-run", action="store_true", help="only list what would be deleted or archived")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    if not args.database_url and not args.db.exists():
+        parser.error(f"{args.db} does not exist")
+    policy = RetentionPolicy(
+        archive_after_days=None if args.no_archive else args.archive_after_days,
+        max_active_sessions=None if args.no_archive else args.max_active_sessions,
+        delete_after_days=args.delete_after_days,
+        max_sessions=args.max_sessions,
+        history_days=args.history_days,
+    )
+    store = open_session_store(args.database_url or args.db)
+    cache = None
+    if args.response_cache.exists():
+        cache = ResponseCache(args.response_cache, ttl=args.response_cache_ttl)
+    try:
+        report = run_maintenance(
+            store, open_archive(store, args.archive_dir), policy,
+            vacuum=args.vacuum, full_vacuum=args.full_vacuum, dry_run=args.dry_run,
+            response_cache=cache,
+        )
+    finally:
+        store.close()
+        if cache is not None:
+            cache.close()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import json
+import math
+import sys
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+# Cap on recorded stages per query, in case a backend streams many
+# distinct processing messages
+MAX_STAGES = 50
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class QueryTimer:
+    """Monotonic stage timestamps for one query, in ms since submission."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages: List[tuple] = []
+        self.durations: Dict[str, float] = {}
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.started) * 1000
+
+    def mark(self, stage: str):
+        if len(self.stages) < MAX_STAGES:
+            self.stages.append((stage, round(self.elapsed_ms(), 2)))
+
+    def mark_once(self, stage: str):
+        if self.offset(stage) is None:
+            self.mark(stage)
+
+    def offset(self, stage: str) -> Optional[float]:
+        for name, offset in self.stages:
+            if name == stage:
+                return offset
+        return None
+
+    @contextmanager
+    def measure(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.durations[name] = round((time.monotonic() - start) * 1000, 2)
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(rows: Iterable[dict], fields=("first_event_ms", "total_ms")) -> Dict[str, dict]:
+    """Per-model count and p50/p95/p99 for each of ``fields``."""
+    by_model: Dict[str, Dict[str, List[float]]] = {}
+    for row in rows:
+        series = by_model.setdefault(row["model_id"], {field: [] for field in fields})
+        for field in fields:
+            if row.get(field) is not None:
+                series[field].append(row[field])
+    summary = {}
+    for model_id, series in sorted(by_model.items()):
+        summary[model_id] = {}
+        for field, values in series.items():
+            values.sort()
+            summary[model_id][field] = {
+                "count": len(values),
+                "sum": round(sum(values), 3),
+                **{q: percentile(values, q) for q in PERCENTILES},
+            }
+    return summary
+
+
+def to_prometheus(summary: Dict[str, dict], prefix: str = "bipp_query") -> str:
+    lines = []
+    fields = sorted({field for series in summary.values() for field in series})
+    for field in fields:
+        name = f"{prefix}_{field}"
+        lines.append(f"# TYPE {name} summary")
+        for model_id, series in summary.items():
+            stats = series.get(field)
+            if not stats or not stats["count"]:
+                continue
+            label = model_id.replace("\\", "\\\\").replace('"', '\\"')
+            for q in PERCENTILES:
+                lines.append(f'{name}{{model="{label}",quantile="{q}"}} {stats[q]}')
+            lines.append(f'{name}_sum{{model="{label}"}} {stats["sum"]}')
+            lines.append(f'{name}_count{{model="{label}"}} {stats["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+def to_json_lines(rows: Iterable[dict]) -> str:
+    return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+
+def deep_sizeof(obj, shared=frozenset(), seen: Optional[set] = None) -> int:
+    """Approximate bytes held by ``obj`` and the containers under it.
+
+    Objects whose id is in ``shared`` (and everything under them) count as
+    zero. Pass the same ``seen`` set to count objects reachable from several
+    roots only once.
+    """
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or id(item) in shared:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, (str, bytes, bytearray)):
+            continue
+        if isinstance(item, Mapping):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+    return total
+
+
+def memory_report(state: Mapping, shared=frozenset()) -> List[dict]:
+    """Per-key size of a session state mapping, largest first."""
+    seen = set()
+    rows = [
+        {"key": key, "bytes": deep_sizeof(value, shared, seen), "shared": id(value) in shared}
+        for key, value in state.items()
+    ]
+    rows.sort(key=lambda row: row["bytes"], reverse=True)
+    return rows
@@ -0,0 +1,635 @@
+"""PostgreSQL session storage, for several app replicas sharing one database.
+
+Selected by setting BIPP_DATABASE_URL (or [storage] url in st.secrets) to a
+postgresql:// URL; see storage.open_session_store(). Needs the psycopg and
+psycopg_pool packages. The schema mirrors SessionStore's SQLite schema, with
+tsvector columns in place of the FTS5 index.
+"""
+import json
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+
+from storage import (
+    ANONYMOUS_OWNER, METRIC_COLUMNS, RETENTION_QUERY, BaseSessionStore, Message, ResultBlob, SessionInfo,
+)
+
+logger = logging.getLogger(__name__)
+
+# Taken around migrations so replicas starting together apply them once
+MIGRATION_LOCK_ID = 0x42495050
+
+# Same scheme as storage.MIGRATIONS; the applied version is kept in the
+# schema_version table. Never edit a released migration; append a new one.
+MIGRATIONS = (
+    # 1: schema equivalent to SQLite version 10
+    (
+        """
+        CREATE TABLE sessions (
+            session_id TEXT PRIMARY KEY,
+            session_name TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            last_activity TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            archived_at TIMESTAMP,
+            name_tsv tsvector GENERATED ALWAYS AS (to_tsvector('simple', session_name)) STORED
+        )
+        """,
+        """
+        CREATE TABLE messages (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            "timestamp" TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            cached INTEGER NOT NULL DEFAULT 0,
+            result_id TEXT,
+            model_id TEXT,
+            group_id TEXT,
+            job_id TEXT,
+            content_tsv tsvector GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED
+        )
+        """,
+        """
+        CREATE TABLE jobs (
+            job_id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            model_id TEXT NOT NULL,
+            assistant_ts TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            finished_at TIMESTAMP,
+            group_id TEXT,
+            worker TEXT
+        )
+        """,
+        """
+        CREATE TABLE results (
+            result_id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            format TEXT NOT NULL,
+            num_rows INTEGER NOT NULL,
+            payload BYTEA NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+        )
+        """,
+        """
+        CREATE TABLE query_metrics (
+            job_id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            model_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            connect_ms DOUBLE PRECISION,
+            first_event_ms DOUBLE PRECISION,
+            completed_ms DOUBLE PRECISION,
+            db_write_ms DOUBLE PRECISION,
+            render_ms DOUBLE PRECISION,
+            total_ms DOUBLE PRECISION,
+            stages TEXT NOT NULL,
+            created_at DOUBLE PRECISION NOT NULL
+        )
+        """,
+        "CREATE INDEX idx_messages_session_id ON messages (session_id, id)",
+        "CREATE INDEX idx_messages_content_tsv ON messages USING GIN (content_tsv)",
+        "CREATE INDEX idx_sessions_last_activity ON sessions (last_activity DESC)",
+        "CREATE INDEX idx_sessions_name_tsv ON sessions USING GIN (name_tsv)",
+        "CREATE INDEX idx_jobs_status ON jobs (status)",
+        "CREATE INDEX idx_jobs_finished_at ON jobs (finished_at)",
+        "CREATE INDEX idx_results_session_id ON results (session_id)",
+        "CREATE INDEX idx_query_metrics_created_at ON query_metrics (created_at)",
+    ),
+    # 2: per-user sessions; existing ones belong to the anonymous owner
+    (
+        "ALTER TABLE sessions ADD COLUMN owner TEXT NOT NULL DEFAULT ''",
+        "CREATE INDEX idx_sessions_owner_last_activity ON sessions (owner, last_activity DESC)",
+    ),
+    # 3: archived sessions, shared by every replica (see maintenance.DatabaseArchive)
+    (
+        """
+        CREATE TABLE session_archives (
+            session_id TEXT PRIMARY KEY,
+            suffix TEXT NOT NULL,
+            data BYTEA NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+        )
+        """,
+    ),
+)
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+TABLES = ("sessions", "messages", "jobs", "results", "query_metrics", "session_archives")
+
+# PostgreSQL's default block size, to report freed space in pages
+BLOCK_SIZE = 8192
+
+UTC_NOW = "(now() AT TIME ZONE 'utc')"
+LAST_ACTIVITY = "to_char(last_activity, 'YYYY-MM-DD HH24:MI:SS')"
+
+
+def migrate(conn, target_version: int = SCHEMA_VERSION) -> int:
+    # DDL is transactional, so each run applies all pending steps or none
+    with conn.transaction():
+        conn.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        row = conn.execute("SELECT version FROM schema_version").fetchone()
+        if row is None:
+            conn.execute("INSERT INTO schema_version (version) VALUES (0)")
+        version = row[0] if row else 0
+        while version < target_version:
+            for statement in MIGRATIONS[version]:
+                conn.execute(statement)
+            version += 1
+        conn.execute("UPDATE schema_version SET version = %s", (version,))
+    return version
+
+
+def ts_query(text: str) -> tuple:
+    """SQL for a tsquery matching every term of ``text`` as a prefix, and its
+    parameters. Terms are passed as quoted literals, never parsed as tsquery
+    syntax."""
+    terms = text.split()
+    sql = " && ".join("to_tsquery('simple', quote_literal(%s::text) || ':*')" for _ in terms)
+    return sql, terms
+
+
+class PostgresDatabase:
+    """Pool of PostgreSQL connections (psycopg_pool)."""
+
+    def __init__(self, url: str, pool_size: int = 8, min_size: int = 1, timeout: float = 5.0):
+        self.url = url
+        self.pool_size = pool_size
+        self.pool = ConnectionPool(
+            url, min_size=min(min_size, pool_size), max_size=pool_size,
+            timeout=timeout, name="bipp-sessions", open=True,
+        )
+        self.init_schema()
+
+    @contextmanager
+    def connection(self):
+        # Commits when the block exits cleanly and rolls back on error
+        with self.pool.connection() as conn:
+            yield conn
+
+    transaction = connection
+
+    @contextmanager
+    def autocommit(self):
+        # VACUUM cannot run inside a transaction block
+        with self.pool.connection() as conn:
+            conn.autocommit = True
+            try:
+                yield conn
+            finally:
+                conn.autocommit = False
+
+    def close(self):
+        self.pool.close()
+
+    def init_schema(self):
+        pass
+
+    # Space reclamation; autovacuum does this routinely, these are for
+    # `python -m maintenance`
+    def space_stats(self) -> Dict[str, object]:
+        with self.connection() as conn:
+            size = conn.execute("SELECT pg_database_size(current_database())").fetchone()[0]
+        return {"database_bytes": size}
+
+    def reclaim_space(self, max_pages: Optional[int] = None) -> int:
+        before = self.space_stats()["database_bytes"]
+        with self.autocommit() as conn:
+            conn.execute(f"VACUUM (ANALYZE) {', '.join(TABLES)}")
+        return max(0, before - self.space_stats()["database_bytes"]) // BLOCK_SIZE
+
+    def checkpoint(self):
+        # The server checkpoints on its own schedule
+        pass
+
+    def compact(self):
+        """Rewrite every table with VACUUM FULL; locks them for the duration."""
+        with self.autocommit() as conn:
+            conn.execute(f"VACUUM (FULL, ANALYZE) {', '.join(TABLES)}")
+
+
+class PostgresSessionStore(BaseSessionStore, PostgresDatabase):
+    """PostgreSQL session storage (see BaseSessionStore for the write-behind
+    buffer). Session and message search uses prefix-matching tsvector
+    indexes; unlike the SQLite FTS5 index it does not fold diacritics.
+    Archived sessions are kept in the session_archives table, which every
+    replica can read."""
+
+    stores_archives = True
+
+    def __init__(
+        self,
+        url: str,
+        flush_interval: float = 0.5,
+        max_pending: int = 500,
+        worker_id: Optional[str] = None,
+        **kwargs
+    ):
+        BaseSessionStore.__init__(self, flush_interval, max_pending, worker_id)
+        PostgresDatabase.__init__(self, url, **kwargs)
+        self._start_flusher()
+
+    def init_schema(self):
+        with self.connection() as conn:
+            migrate(conn)
+
+    def _is_transient_error(self, error: Exception) -> bool:
+        # Lost connections and pool timeouts (PoolTimeout is one); errors
+        # caused by the data are other DatabaseError subclasses
+        return isinstance(error, psycopg.OperationalError)
+
+    def _write_batch(self, messages, touches, jobs, metrics, render_times):
+        with self.transaction() as conn:
+            cur = conn.cursor()
+            cur.executemany(
+                """
+                INSERT INTO jobs (job_id, session_id, prompt, model_id, assistant_ts, group_id, worker, status)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, 'queued')
+                """,
+                jobs
+            )
+            cur.executemany(
+                """
+                INSERT INTO messages (session_id, role, content, "timestamp", cached, model_id, group_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """,
+                messages
+            )
+            cur.executemany(
+                "UPDATE sessions SET last_activity = %s::timestamp WHERE session_id = %s",
+                [(ts, session_id) for session_id, ts in touches.items()]
+            )
+            cur.executemany(
+                f"""
+                INSERT INTO query_metrics ({", ".join(METRIC_COLUMNS)})
+                VALUES ({", ".join("%s" for _ in METRIC_COLUMNS)})
+                ON CONFLICT (job_id) DO NOTHING
+                """,
+                metrics
+            )
+            cur.executemany(
+                "UPDATE query_metrics SET render_ms = %s WHERE job_id = %s",
+                render_times
+            )
+
+    # Sessions
+    def save_session(self, session_id: str, session_name: str, owner: str = ANONYMOUS_OWNER):
+        with self.transaction() as conn:
+            conn.execute(
+                f"""
+                INSERT INTO sessions (session_id, session_name, owner, last_activity)
+                VALUES (%s, %s, %s, {UTC_NOW})
+                ON CONFLICT (session_id) DO UPDATE SET
+                    session_name = excluded.session_name,
+                    last_activity = excluded.last_activity
+                WHERE sessions.owner = excluded.owner
+                """,
+                (session_id, session_name, owner)
+            )
+        self._bump_sessions_version()
+
+    def is_archived(self, session_id: str) -> bool:
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT archived_at IS NOT NULL FROM sessions WHERE session_id = %s", (session_id,)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def list_sessions(self, limit: int, offset: int = 0, owner: Optional[str] = None):
+        where, params = _owner_filter(owner)
+        with self.connection() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT session_id, session_name, {LAST_ACTIVITY}
+                FROM sessions {where}
+                ORDER BY last_activity DESC
+                LIMIT %s OFFSET %s
+                """,
+                (*params, limit, offset)
+            ).fetchall()
+        return [SessionInfo(*r) for r in rows]
+
+    def search_sessions(self, text: str, limit: int, owner: Optional[str] = None):
+        """Sessions whose name or any message matches ``text``, most recent first."""
+        if not text.split():
+            return self.list_sessions(limit, owner=owner)
+        query_sql, terms = ts_query(text)
+        scope = "AND owner = %s" if owner is not None else ""
+        with self.connection() as conn:
+            rows = conn.execute(
+                f"""
+                WITH q AS (SELECT {query_sql} AS query)
+                SELECT session_id, session_name, {LAST_ACTIVITY} FROM sessions, q
+                WHERE (name_tsv @@ q.query
+                   OR session_id IN (SELECT m.session_id FROM messages m, q WHERE m.content_tsv @@ q.query))
+                   {scope}
+                ORDER BY last_activity DESC
+                LIMIT %s
+                """,
+                (*terms, *((owner,) if owner is not None else ()), limit)
+            ).fetchall()
+        return [SessionInfo(*r) for r in rows]
+
+    def get_all_sessions(self, owner: Optional[str] = None):
+        where, params = _owner_filter(owner)
+        with self.connection() as conn:
+            rows = conn.execute(
+                f"SELECT session_id, session_name, {LAST_ACTIVITY} FROM sessions {where} ORDER BY last_activity DESC",
+                params
+            ).fetchall()
+        return [SessionInfo(*r) for r in rows]
+
+    def _owns(self, conn, session_id: str, owner: Optional[str]) -> bool:
+        if owner is None:
+            return True
+        return conn.execute(
+            "SELECT 1 FROM sessions WHERE session_id = %s AND owner = %s", (session_id, owner)
+        ).fetchone() is not None
+
+    def delete_session(self, session_id: str, owner: Optional[str] = None) -> bool:
+        """Delete a session and everything in it; False if ``owner`` does not own it."""
+        self.flush()
+        with self.transaction() as conn:
+            if not self._owns(conn, session_id, owner):
+                return False
+            conn.execute("DELETE FROM results WHERE session_id = %s", (session_id,))
+            conn.execute("DELETE FROM messages WHERE session_id = %s", (session_id,))
+            conn.execute("DELETE FROM session_archives WHERE session_id = %s", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = %s", (session_id,))
+        self._bump_sessions_version()
+        return True
+
+    # Messages
+    def load_session_messages(
+        self, session_id: str, limit: int = None, before_id: int = None, owner: Optional[str] = None
+    ):
+        """Return messages oldest-first; with ``limit``, only the newest ``limit``
+        messages older than ``before_id`` (keyset pagination on ``id``)."""
+        query = """
+            SELECT m.id, m.role, m.content, m."timestamp", m.cached, m.result_id,
+                   m.model_id, m.group_id, q.total_ms
+            FROM messages m LEFT JOIN query_metrics q ON q.job_id = m.job_id
+            WHERE m.session_id = %s
+        """
+        params = [session_id]
+        if owner is not None:
+            query += " AND EXISTS (SELECT 1 FROM sessions s WHERE s.session_id = m.session_id AND s.owner = %s)"
+            params.append(owner)
+        if before_id is not None:
+            query += " AND m.id < %s"
+            params.append(before_id)
+        if limit is None:
+            query += " ORDER BY m.id ASC"
+        else:
+            query += " ORDER BY m.id DESC LIMIT %s"
+            params.append(limit)
+        # Also waits for a batch the background flusher is still writing
+        self.flush()
+        with self.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        if limit is not None:
+            rows.reverse()
+        return [
+            Message(
+                role=r[1], content=r[2], timestamp=r[3], id=r[0], cached=bool(r[4]),
+                result_id=r[5], model_id=r[6], group_id=r[7], latency_ms=r[8],
+            )
+            for r in rows
+        ]
+
+    def clear_session_messages(self, session_id: str, owner: Optional[str] = None):
+        self.flush()
+        with self.transaction() as conn:
+            if not self._owns(conn, session_id, owner):
+                return
+            conn.execute("DELETE FROM results WHERE session_id = %s", (session_id,))
+            conn.execute("DELETE FROM messages WHERE session_id = %s", (session_id,))
+
+    # Jobs
+    def finish_job(
+        self,
+        job_id: str,
+        session_id: str,
+        status: str,
+        content: str,
+        assistant_ts: str,
+        result: Optional[ResultBlob] = None,
+    ) -> bool:
+        """Store the assistant answer (and its result set) and close the job in
+        one transaction. Does nothing if the job was already closed, e.g.
+        failed as lost by another process; returns whether it was stored."""
+        # Flush first so the job row exists and the answer is ordered after
+        # the buffered question
+        self.flush()
+        with self.transaction() as conn:
+            if not self._finish_job(conn, job_id, session_id, status, content, assistant_ts, result):
+                return False
+        self._bump_sessions_version()
+        return True
+
+    def load_result(self, result_id: str) -> Optional[ResultBlob]:
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT result_id, format, num_rows, payload FROM results WHERE result_id = %s",
+                (result_id,)
+            ).fetchone()
+        return ResultBlob(row[0], row[1], row[2], bytes(row[3])) if row is not None else None
+
+    def fail_active_jobs(self, status: str, content: str, stale_before: Optional[str] = None, own: bool = True):
+        """Finish jobs left queued or running by a previous process: with
+        ``own``, this worker's, plus any replica's created before
+        ``stale_before``. Younger jobs of other replicas are left alone."""
+        with self.transaction() as conn:
+            rows = conn.execute(
+                """
+                SELECT job_id, session_id, assistant_ts FROM jobs
+                WHERE status IN ('queued', 'running')
+                  AND ((%s AND (worker = %s OR worker IS NULL)) OR created_at < %s::timestamp)
+                FOR UPDATE SKIP LOCKED
+                """,
+                (own, self.worker_id, stale_before)
+            ).fetchall()
+            for job_id, session_id, assistant_ts in rows:
+                self._finish_job(conn, job_id, session_id, status, content, assistant_ts)
+
+    def _finish_job(self, conn, job_id, session_id, status, content, assistant_ts, result=None) -> bool:
+        # Only an active job gets an answer; see SessionStore._finish_job
+        closed = conn.execute(
+            f"""
+            UPDATE jobs SET status = %s, finished_at = {UTC_NOW}
+            WHERE job_id = %s AND status IN ('queued', 'running')
+            """,
+            (status, job_id)
+        ).rowcount
+        if not closed:
+            return False
+        if result is not None:
+            conn.execute(
+                """
+                INSERT INTO results (result_id, session_id, format, num_rows, payload)
+                VALUES (%s, %s, %s, %s, %s)
+                """,
+                (result.result_id, session_id, result.format, result.num_rows, result.payload)
+            )
+        conn.execute(
+            """
+            INSERT INTO messages (session_id, role, content, "timestamp", result_id, model_id, group_id, job_id)
+            SELECT %s, 'assistant', %s, %s, %s, model_id, group_id, job_id FROM jobs WHERE job_id = %s
+            """,
+            (session_id, content, assistant_ts, result.result_id if result is not None else None, job_id)
+        )
+        conn.execute(f"UPDATE sessions SET last_activity = {UTC_NOW} WHERE session_id = %s", (session_id,))
+        return True
+
+    # Metrics
+    def load_query_metrics(self, since: float = None, limit: int = 5000):
+        query = f"SELECT {', '.join(METRIC_COLUMNS)} FROM query_metrics"
+        params = []
+        if since is not None:
+            query += " WHERE created_at >= %s"
+            params.append(since)
+        query += " ORDER BY created_at DESC LIMIT %s"
+        params.append(limit)
+        with self.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        metrics = [dict(zip(METRIC_COLUMNS, row)) for row in rows]
+        for row in metrics:
+            row["stages"] = json.loads(row["stages"])
+        return metrics
+
+    # Retention and archival
+    def sessions_to_archive(self, idle_before: str, keep_active: Optional[int] = None) -> List[str]:
+        return self._select_session_ids(RETENTION_QUERY.format(where="WHERE archived_at IS NULL"), idle_before, keep_active)
+
+    def sessions_to_delete(self, idle_before: str, keep: Optional[int] = None) -> List[str]:
+        return self._select_session_ids(RETENTION_QUERY.format(where=""), idle_before, keep)
+
+    def _select_session_ids(self, query: str, idle_before: str, keep: Optional[int]) -> List[str]:
+        self.flush()
+        with self.connection() as conn:
+            rows = conn.execute(query.replace("?", "%s"), (idle_before, keep)).fetchall()
+        return [r[0] for r in rows]
+
+    def archive_session(self, session_id: str, write: Callable[[dict, List[dict], List[dict]], None]) -> bool:
+        """Move a session's messages and results out of the database.
+
+        The rows are deleted and handed to ``write`` in one transaction that
+        commits only after ``write`` returns; messages added concurrently
+        stay in the table and are kept alongside the archive on restore.
+        """
+        self.flush()
+        with self.transaction() as conn:
+            cur = conn.cursor(row_factory=dict_row)
+            columns = {table: _columns(conn, table) for table in ("sessions", "messages", "results")}
+            session = cur.execute(
+                f"SELECT {columns['sessions']} FROM sessions WHERE session_id = %s AND archived_at IS NULL FOR UPDATE",
+                (session_id,)
+            ).fetchone()
+            if session is None:
+                return False
+            messages = cur.execute(
+                f"DELETE FROM messages WHERE session_id = %s RETURNING {columns['messages']}", (session_id,)
+            ).fetchall()
+            results = cur.execute(
+                f"DELETE FROM results WHERE session_id = %s RETURNING {columns['results']}", (session_id,)
+            ).fetchall()
+            messages.sort(key=lambda row: row["id"])
+            cur.execute(f"UPDATE sessions SET archived_at = {UTC_NOW} WHERE session_id = %s", (session_id,))
+            write(_plain(session), [_plain(row) for row in messages], [_plain(row) for row in results])
+        return True
+
+    def save_archive(self, session_id: str, suffix: str, data: bytes):
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO session_archives (session_id, suffix, data) VALUES (%s, %s, %s)
+                ON CONFLICT (session_id) DO UPDATE SET
+                    suffix = excluded.suffix, data = excluded.data, created_at = excluded.created_at
+                """,
+                (session_id, suffix, data)
+            )
+
+    def load_archive(self, session_id: str) -> Optional[Tuple[str, bytes]]:
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT suffix, data FROM session_archives WHERE session_id = %s", (session_id,)
+            ).fetchone()
+        return (row[0], bytes(row[1])) if row is not None else None
+
+    def delete_archive(self, session_id: str):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM session_archives WHERE session_id = %s", (session_id,))
+
+    def restore_session(self, session_id: str, messages: List[dict], results: List[dict]):
+        """Put archived rows back, keeping their original ids (and so their
+        order), and clear the archived flag."""
+        with self.transaction() as conn:
+            for table, rows in (("messages", messages), ("results", results)):
+                columns = set(_column_names(conn, table))
+                for row in rows:
+                    row = {key: value for key, value in row.items() if key in columns}
+                    row["session_id"] = session_id
+                    conn.execute(
+                        f"""
+                        INSERT INTO {table} ({', '.join(f'"{key}"' for key in row)})
+                        VALUES ({', '.join('%s' for _ in row)})
+                        ON CONFLICT DO NOTHING
+                        """,
+                        tuple(row.values())
+                    )
+            conn.execute("UPDATE sessions SET archived_at = NULL WHERE session_id = %s", (session_id,))
+
+    def purge_history(self, jobs_before: str, metrics_before: float) -> Dict[str, int]:
+        self.flush()
+        with self.transaction() as conn:
+            jobs = conn.execute(
+                """
+                DELETE FROM jobs
+                WHERE status NOT IN ('queued', 'running') AND finished_at < %s::timestamp
+                """,
+                (jobs_before,)
+            ).rowcount
+            metrics = conn.execute("DELETE FROM query_metrics WHERE created_at < %s", (metrics_before,)).rowcount
+        return {"jobs": jobs, "metrics": metrics}
+
+
+def _owner_filter(owner: Optional[str]):
+    return ("WHERE owner = %s", (owner,)) if owner is not None else ("", ())
+
+
+def _column_names(conn, table: str) -> List[str]:
+    # Generated tsvector columns are derived, so they are neither archived
+    # nor restored
+    rows = conn.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+        """,
+        (table,)
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+def _columns(conn, table: str) -> str:
+    return ", ".join(f'"{name}"' for name in _column_names(conn, table))
+
+
+def _plain(row: dict) -> dict:
+    # Archive files hold timestamps in the SQLite text format, so either
+    # backend can restore them
+    return {
+        key: value.strftime("%Y-%m-%d %H:%M:%S") if isinstance(value, datetime)
+        else bytes(value) if isinstance(value, memoryview) else value
+        for key, value in row.items()
+    }
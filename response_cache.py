@@ -0,0 +1,113 @@
+import hashlib
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from storage import SQLiteDatabase
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.split()).casefold()
+
+
+def cache_key(prompt: str, model_id: str, epoch: str = "") -> str:
+    raw = "\x1f".join((epoch, model_id, normalize_prompt(prompt)))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(SQLiteDatabase):
+    """Completed answers keyed on normalized prompt + model + data epoch.
+
+    Entries expire after ``ttl`` seconds and the table is trimmed to the
+    ``max_entries`` most recently used rows. Bumping ``epoch`` (e.g. after a
+    data load) invalidates every earlier entry without touching the file.
+    """
+
+    def __init__(self, db_path: Path, ttl: int = 3600, max_entries: int = 1000, epoch: str = "", **kwargs):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.epoch = epoch
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        super().__init__(db_path, **kwargs)
+
+    def init_schema(self):
+        super().init_schema()
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    model_id TEXT NOT NULL,
+                    prompt TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_response_cache_last_access ON response_cache (last_access)"
+            )
+
+    def get(self, prompt: str, model_id: str) -> Optional[str]:
+        key = cache_key(prompt, model_id, self.epoch)
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT content, created_at FROM response_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM response_cache WHERE cache_key = ?", (key,))
+                row = None
+            if row is not None:
+                conn.execute(
+                    "UPDATE response_cache SET last_access = ?, hits = hits + 1 WHERE cache_key = ?",
+                    (now, key)
+                )
+        with self._stats_lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return row[0] if row is not None else None
+
+    def put(self, prompt: str, model_id: str, content: str):
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO response_cache (cache_key, model_id, prompt, content, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (cache_key) DO UPDATE SET
+                    content = excluded.content,
+                    created_at = excluded.created_at,
+                    last_access = excluded.last_access
+                """,
+                (cache_key(prompt, model_id, self.epoch), model_id, prompt, content, now, now)
+            )
+            # LRU eviction down to max_entries
+            conn.execute(
+                """
+                DELETE FROM response_cache WHERE cache_key IN (
+                    SELECT cache_key FROM response_cache
+                    ORDER BY last_access DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,)
+            )
+
+    def purge_expired(self) -> int:
+        with self.transaction() as conn:
+            return conn.execute(
+                "DELETE FROM response_cache WHERE created_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+
+    def stats(self) -> dict:
+        with self.connection() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
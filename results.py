@@ -0,0 +1,69 @@
+import base64
+import uuid
+from typing import Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+RESULT_FORMAT = "parquet"
+PARQUET_COMPRESSION = "zstd"
+PARQUET_ROW_GROUP_SIZE = 64 * 1024
+
+
+def new_result_id() -> str:
+    return str(uuid.uuid4())
+
+
+def _column_array(values) -> pa.Array:
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed-type column: keep it displayable as text
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+def table_from_payload(payload: dict) -> pa.Table:
+    """Build an Arrow table from a structured result sent by the backend.
+
+    Accepts ``{"columns": [...], "rows": [[...], ...]}`` (rows may also be
+    dicts keyed by column) or ``{"format": "arrow", "data": <base64 Arrow IPC
+    stream>}``.
+    """
+    if payload.get("format") == "arrow":
+        with pa.ipc.open_stream(base64.b64decode(payload["data"])) as reader:
+            return reader.read_all()
+    columns = [str(c) for c in payload.get("columns", [])]
+    rows = payload.get("rows", [])
+    if rows and isinstance(rows[0], dict):
+        columns = columns or [str(c) for c in rows[0]]
+        rows = [[row.get(c) for c in columns] for row in rows]
+    if not rows:
+        return pa.table({c: pa.array([], type=pa.null()) for c in columns})
+    arrays = [_column_array(list(values)) for values in zip(*rows)]
+    return pa.Table.from_arrays(arrays, names=columns)
+
+
+def encode_table(table: pa.Table) -> bytes:
+    sink = pa.BufferOutputStream()
+    pq.write_table(
+        table,
+        sink,
+        compression=PARQUET_COMPRESSION,
+        row_group_size=PARQUET_ROW_GROUP_SIZE,
+    )
+    return sink.getvalue().to_pybytes()
+
+
+def decode_preview(blob: bytes, max_rows: int) -> Tuple[pa.Table, int]:
+    """The first ``max_rows`` rows of an encoded result set and its total
+    row count. Only the row groups needed for the preview are decoded."""
+    parquet = pq.ParquetFile(pa.BufferReader(blob))
+    batches, rows = [], 0
+    if max_rows > 0:
+        for batch in parquet.iter_batches(batch_size=min(max_rows, PARQUET_ROW_GROUP_SIZE)):
+            batches.append(batch.slice(0, max_rows - rows))
+            rows += batches[-1].num_rows
+            if rows >= max_rows:
+                break
+    table = pa.Table.from_batches(batches, schema=parquet.schema_arrow)
+    return table, parquet.metadata.num_rows
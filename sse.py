@@ -0,0 +1,173 @@
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional
+
+import requests
+
+from http_client import CancelToken
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Event types the backend may send purely to keep the connection alive
+HEARTBEAT_EVENTS = frozenset({"ping", "heartbeat", "keepalive"})
+
+DEFAULT_RETRY_MS = 1000
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class SSEStreamError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class SSEEvent:
+    data: str
+    event: str = "message"
+    id: Optional[str] = None
+    retry: Optional[int] = None
+
+
+class SSEDecoder:
+    """Incremental text/event-stream decoder fed with raw byte chunks."""
+
+    def __init__(self):
+        self._buffer = b""
+        self._data = []
+        self._event = ""
+        self._retry = None
+        self.last_event_id = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        self._buffer += chunk
+        lines = self._buffer.splitlines(keepends=True)
+        # A trailing line without terminator is incomplete; a lone trailing
+        # \r may still be the first half of \r\n.
+        if lines and (not lines[-1].endswith((b"\n", b"\r")) or lines[-1].endswith(b"\r")):
+            self._buffer = lines.pop()
+        else:
+            self._buffer = b""
+        events = []
+        for raw in lines:
+            event = self._process_line(raw.rstrip(b"\r\n").decode("utf-8", errors="replace"))
+            if event is not None:
+                events.append(event)
+        return events
+
+    def _process_line(self, line: str) -> Optional[SSEEvent]:
+        if not line:
+            return self._dispatch()
+        if line.startswith(":"):
+            return None
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            self._data.append(value)
+        elif field == "event":
+            self._event = value
+        elif field == "id":
+            if "\0" not in value:
+                self.last_event_id = value
+        elif field == "retry":
+            if value.isdigit():
+                self._retry = int(value)
+        return None
+
+    def _dispatch(self) -> Optional[SSEEvent]:
+        if not self._data:
+            self._event = ""
+            return None
+        event = SSEEvent(
+            data="\n".join(self._data),
+            event=self._event or "message",
+            id=self.last_event_id,
+            retry=self._retry,
+        )
+        self._data = []
+        self._event = ""
+        return event
+
+
+def stream_events(
+    session: requests.Session,
+    url: str,
+    payload: dict,
+    timeout,
+    deadline: float,
+    max_resumes: int = 3,
+    on_response: Optional[Callable[[], None]] = None,
+    cancel: Optional[CancelToken] = None,
+) -> Iterator[SSEEvent]:
+    """POST ``payload`` and yield SSE events until the stream ends.
+
+    ``timeout`` is the (connect, read) pair passed to requests; with a streamed
+    body the read timeout acts as the idle/heartbeat timeout. ``deadline``
+    bounds the whole exchange in seconds. If the connection drops after the
+    server has sent an event id, the request is re-sent with Last-Event-ID so
+    the backend can resume the stream instead of re-running the query.
+    ``on_response`` is called once response headers arrive on each connection.
+    Once ``cancel`` is cancelled the stream ends quietly, without resuming.
+    """
+    decoder = SSEDecoder()
+    expires_at = time.monotonic() + deadline
+    retry_ms = DEFAULT_RETRY_MS
+    resumes = 0
+    while True:
+        if cancel is not None and cancel.cancelled:
+            return
+        headers = {"Accept": "text/event-stream"}
+        if decoder.last_event_id is not None:
+            headers["Last-Event-ID"] = decoder.last_event_id
+        try:
+            with session.post(url, json=payload, headers=headers, stream=True, timeout=timeout) as res:
+                if cancel is not None:
+                    cancel.attach(res)
+                if on_response is not None:
+                    on_response()
+                if res.status_code != 200:
+                    raise SSEStreamError(f"HTTP {res.status_code}: {res.text}", res.status_code)
+                for chunk in res.iter_content(chunk_size=None):
+                    if cancel is not None and cancel.cancelled:
+                        return
+                    for event in decoder.feed(chunk):
+                        if event.retry is not None:
+                            retry_ms = event.retry
+                        if event.event not in HEARTBEAT_EVENTS:
+                            yield event
+                    if time.monotonic() > expires_at:
+                        raise SSEStreamError("A consulta excedeu o tempo limite.")
+            return
+        except (requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as e:
+            if cancel is not None and cancel.cancelled:
+                return
+            remaining = expires_at - time.monotonic()
+            if decoder.last_event_id is None or resumes >= max_resumes or remaining <= 0:
+                raise SSEStreamError(str(e)) from e
+            resumes += 1
+            logger.warning("SSE stream dropped (%s); resuming from event %s", e, decoder.last_event_id)
+            time.sleep(min(retry_ms / 1000, remaining))
+            decoder = _resume_decoder(decoder)
+
+
+def _resume_decoder(previous: SSEDecoder) -> SSEDecoder:
+    # Partial frames from the dropped connection are discarded; the server
+    # replays everything after last_event_id.
+    decoder = SSEDecoder()
+    decoder.last_event_id = previous.last_event_id
+    return decoder
@@ -0,0 +1,1121 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResultBlob(NamedTuple):
+    """Encoded result set of an assistant message, stored in ``results``."""
+    result_id: str
+    format: str
+    num_rows: int
+    payload: bytes
+
+
+class Message(NamedTuple):
+    """One chat message. A tuple rather than a dict, so the window of
+    messages each browser session holds stays compact."""
+    role: str
+    content: str
+    timestamp: Optional[str] = None
+    id: Optional[int] = None
+    cached: bool = False
+    result_id: Optional[str] = None
+    model_id: Optional[str] = None
+    group_id: Optional[str] = None
+    latency_ms: Optional[float] = None
+
+
+class SessionInfo(NamedTuple):
+    session_id: str
+    session_name: str
+    last_activity: str
+
+# Applied to every pooled connection. journal_mode is persistent in the
+# database file, so it is only set once in init_schema().
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+
+
+def _create_search_index(conn: sqlite3.Connection):
+    # Full-text index over session names and message content. SQLite builds
+    # without FTS5 skip it; search then falls back to LIKE scans.
+    if not fts5_available(conn):
+        return
+    statements = (
+        """
+        CREATE VIRTUAL TABLE messages_fts USING fts5(
+            content, content='messages', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE VIRTUAL TABLE sessions_fts USING fts5(
+            session_name, content='sessions', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER messages_fts_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+        """,
+        """
+        CREATE TRIGGER messages_fts_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+        """,
+        """
+        CREATE TRIGGER messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+        """,
+        """
+        CREATE TRIGGER sessions_fts_ai AFTER INSERT ON sessions BEGIN
+            INSERT INTO sessions_fts (rowid, session_name) VALUES (new.rowid, new.session_name);
+        END
+        """,
+        """
+        CREATE TRIGGER sessions_fts_ad AFTER DELETE ON sessions BEGIN
+            INSERT INTO sessions_fts (sessions_fts, rowid, session_name) VALUES ('delete', old.rowid, old.session_name);
+        END
+        """,
+        """
+        CREATE TRIGGER sessions_fts_au AFTER UPDATE OF session_name ON sessions BEGIN
+            INSERT INTO sessions_fts (sessions_fts, rowid, session_name) VALUES ('delete', old.rowid, old.session_name);
+            INSERT INTO sessions_fts (rowid, session_name) VALUES (new.rowid, new.session_name);
+        END
+        """,
+        "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+        "INSERT INTO sessions_fts (sessions_fts) VALUES ('rebuild')",
+    )
+    for statement in statements:
+        conn.execute(statement)
+
+
+# Schema migrations, applied in order. Version N is MIGRATIONS[N - 1] and the
+# applied version is tracked in PRAGMA user_version. A migration is either a
+# tuple of SQL statements or a callable taking the connection. Never edit a
+# released migration; append a new one instead.
+MIGRATIONS = (
+    # 1: base schema (databases created before versioning start here)
+    (
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            session_name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions (session_id)
+        )
+        """,
+    ),
+    # 2: indexes for per-session message loads and the sidebar session list
+    (
+        "CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions (last_activity DESC)",
+    ),
+    # 3: background query jobs
+    (
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            model_id TEXT NOT NULL,
+            assistant_ts TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)",
+    ),
+    # 4: answers served from the response cache
+    (
+        "ALTER TABLE messages ADD COLUMN cached INTEGER NOT NULL DEFAULT 0",
+    ),
+    # 5: full-text search over sessions and messages
+    _create_search_index,
+    # 6: structured result sets, stored apart from the chat text
+    (
+        """
+        CREATE TABLE IF NOT EXISTS results (
+            result_id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            format TEXT NOT NULL,
+            num_rows INTEGER NOT NULL,
+            payload BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_results_session_id ON results (session_id)",
+        "ALTER TABLE messages ADD COLUMN result_id TEXT",
+    ),
+    # 7: per-query latency metrics
+    (
+        """
+        CREATE TABLE IF NOT EXISTS query_metrics (
+            job_id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            model_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            connect_ms REAL,
+            first_event_ms REAL,
+            completed_ms REAL,
+            db_write_ms REAL,
+            render_ms REAL,
+            total_ms REAL,
+            stages TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_query_metrics_created_at ON query_metrics (created_at)",
+    ),
+    # 8: model comparisons; answers to one prompt from several models share
+    # a group_id, and answers link to the job (and its metrics) behind them
+    (
+        "ALTER TABLE jobs ADD COLUMN group_id TEXT",
+        "ALTER TABLE messages ADD COLUMN model_id TEXT",
+        "ALTER TABLE messages ADD COLUMN group_id TEXT",
+        "ALTER TABLE messages ADD COLUMN job_id TEXT",
+    ),
+    # 9: archival; an archived session keeps its row (and sidebar entry)
+    # while its messages and results live in a compressed file
+    (
+        "ALTER TABLE sessions ADD COLUMN archived_at TIMESTAMP",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON jobs (finished_at)",
+    ),
+    # 10: the process (replica) running each job
+    (
+        "ALTER TABLE jobs ADD COLUMN worker TEXT",
+    ),
+    # 11: per-user sessions; existing ones belong to the anonymous owner
+    (
+        "ALTER TABLE sessions ADD COLUMN owner TEXT NOT NULL DEFAULT ''",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_owner_last_activity ON sessions (owner, last_activity DESC)",
+    ),
+)
+
+METRIC_COLUMNS = (
+    "job_id", "session_id", "model_id", "status", "connect_ms", "first_event_ms",
+    "completed_ms", "db_write_ms", "render_ms", "total_ms", "stages", "created_at",
+)
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Owner of sessions created without an identity, and of every session that
+# predates per-user sessions
+ANONYMOUS_OWNER = ""
+
+# Free pages returned to the filesystem after deleting a session; the rest
+# is left for `python -m maintenance --vacuum`
+DELETE_VACUUM_PAGES = 2048
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+# Sessions idle since before the first parameter or ranked past the second
+# (None: no limit) among their owner's most recent; pg_storage swaps in its
+# own placeholders.
+RETENTION_QUERY = """
+    SELECT session_id FROM (
+        SELECT session_id, last_activity,
+               ROW_NUMBER() OVER (PARTITION BY owner ORDER BY last_activity DESC) AS recency
+        FROM sessions {where}
+    ) ranked
+    WHERE (last_activity < ? OR recency > COALESCE(?, recency))
+      AND session_id NOT IN (SELECT session_id FROM jobs WHERE status IN ('queued', 'running'))
+    ORDER BY last_activity
+"""
+
+
+def fts5_available(conn: sqlite3.Connection) -> bool:
+    return bool(conn.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0])
+
+
+def fts_query(text: str) -> str:
+    # Each whitespace-separated term becomes a quoted prefix match, so user
+    # input can never be parsed as FTS5 query syntax.
+    terms = ['"' + term.replace('"', '""') + '"*' for term in text.split()]
+    return " ".join(terms)
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, target_version: int = SCHEMA_VERSION) -> int:
+    if get_schema_version(conn) >= target_version:
+        return get_schema_version(conn)
+    # BEGIN IMMEDIATE takes the write lock up front, so concurrent processes
+    # starting at the same time apply each migration exactly once.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = get_schema_version(conn)
+        while version < target_version:
+            step = MIGRATIONS[version]
+            if callable(step):
+                step(conn)
+            else:
+                for statement in step:
+                    conn.execute(statement)
+            version += 1
+            conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return version
+
+
+class SQLiteDatabase:
+    """Pool of shared SQLite connections to one database file in WAL mode."""
+
+    def __init__(self, db_path: Path, pool_size: int = 8, busy_timeout: float = 5.0):
+        self.db_path = Path(db_path)
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self.init_schema()
+
+    # Connection pool
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+        )
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._pool.get(timeout=self.busy_timeout)
+        except queue.Empty:
+            # Same error as a locked database, so callers retry it the same way
+            raise sqlite3.OperationalError("connection pool busy") from None
+
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._pool.put_nowait(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except sqlite3.ProgrammingError:
+            # Closed or otherwise unusable connection: drop it from the pool.
+            with self._lock:
+                self._created -= 1
+            conn.close()
+            raise
+        except BaseException:
+            self._release(conn)
+            raise
+        else:
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            with conn:
+                yield conn
+
+    def close(self):
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def init_schema(self):
+        with self.connection() as conn:
+            # Only takes effect on a new, empty database file; existing files
+            # are converted by compact()
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA journal_mode = WAL")
+
+    # Space reclamation
+    def space_stats(self) -> Dict[str, object]:
+        with self.connection() as conn:
+            stats = {
+                name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+                for name in ("page_size", "page_count", "freelist_count", "auto_vacuum")
+            }
+        stats["auto_vacuum"] = AUTO_VACUUM_MODES.get(stats["auto_vacuum"], stats["auto_vacuum"])
+        return stats
+
+    def reclaim_space(self, max_pages: Optional[int] = None) -> int:
+        """Return up to ``max_pages`` free pages (all if None) to the
+        filesystem. Needs incremental auto_vacuum; returns pages freed."""
+        with self.connection() as conn:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # The pragma frees one page per step and execute() only steps it
+            # once; executescript() runs it to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages or 0)})")
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return before - after
+
+    def checkpoint(self):
+        """Copy the WAL into the database file and truncate it."""
+        with self.connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+    def compact(self):
+        """Rebuild the file with VACUUM, switching it to incremental
+        auto_vacuum. Blocks writers for the duration; run it offline."""
+        with self.connection() as conn:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        self.checkpoint()
+
+
+class BaseSessionStore(ABC):
+    """Storage interface for sessions, messages, jobs and query metrics.
+
+    Implemented by SessionStore (SQLite, the default) and by
+    pg_storage.PostgresSessionStore (PostgreSQL, for replicas sharing one
+    database); open_session_store() picks one from a path or URL.
+
+    Message inserts, session activity touches, new job rows and metrics are
+    buffered and written by a background thread in one transaction every
+    ``flush_interval`` seconds (or as soon as ``max_pending`` writes queue
+    up). Anything that reads or deletes a session's messages flushes first,
+    and pending writes are flushed at interpreter exit. Backends implement
+    _write_batch() and the query methods; their database class provides
+    space_stats(), reclaim_space(), checkpoint() and compact().
+
+    Sessions belong to an ``owner``. Reads and deletes given an owner only
+    see that owner's sessions; owner=None is unscoped, for maintenance.
+
+    Jobs are tagged with ``worker_id`` (default: host name and process id),
+    so a restarting process only fails the jobs it had in flight itself.
+    Jobs of processes that never come back under the same id are failed
+    once they are stale (see JobManager).
+    """
+
+    # Whether archived sessions are kept in the database (save_archive() and
+    # friends) rather than in files next to it; see maintenance.open_archive
+    stores_archives = False
+
+    def __init__(self, flush_interval: float = 0.5, max_pending: int = 500, worker_id: Optional[str] = None):
+        # Bumped on every write that can change the session list, so callers
+        # can skip re-querying it while nothing has changed. Per process:
+        # other replicas' writes show up on the next change seen here.
+        self.sessions_version = 0
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._pending_messages = []
+        self._pending_touches = {}
+        self._pending_jobs = []
+        self._pending_metrics = []
+        self._pending_render_times = []
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._version_lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def _start_flusher(self):
+        self._flusher = threading.Thread(target=self._flush_loop, name="bipp-store-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def _bump_sessions_version(self):
+        with self._version_lock:
+            self.sessions_version += 1
+
+    # Write-behind buffer
+    def _enqueue(self, messages=(), touches=(), jobs=(), metrics=(), render_times=()):
+        now = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        with self._pending_lock:
+            self._pending_messages.extend(messages)
+            self._pending_jobs.extend(jobs)
+            self._pending_metrics.extend(metrics)
+            self._pending_render_times.extend(render_times)
+            for session_id in touches:
+                # Re-insert so dict order follows the latest touch
+                self._pending_touches.pop(session_id, None)
+                self._pending_touches[session_id] = now
+            pending = (
+                len(self._pending_messages) + len(self._pending_touches) + len(self._pending_jobs)
+                + len(self._pending_metrics) + len(self._pending_render_times)
+            )
+        if pending >= self.max_pending:
+            self._wake.set()
+
+    @property
+    def has_pending_writes(self) -> bool:
+        return bool(
+            self._pending_messages or self._pending_touches or self._pending_jobs
+            or self._pending_metrics or self._pending_render_times
+        )
+
+    def flush(self):
+        """Write every buffered change in a single transaction.
+
+        If the database is busy the batch stays queued for the next flush.
+        Any other error is blamed on the rows: they are retried one at a
+        time and the ones the database rejects are logged and dropped, so a
+        bad row cannot block every later write.
+        """
+        with self._flush_lock:
+            with self._pending_lock:
+                messages, self._pending_messages = self._pending_messages, []
+                touches, self._pending_touches = self._pending_touches, {}
+                jobs, self._pending_jobs = self._pending_jobs, []
+                metrics, self._pending_metrics = self._pending_metrics, []
+                render_times, self._pending_render_times = self._pending_render_times, []
+            if not (messages or touches or jobs or metrics or render_times):
+                return
+            try:
+                self._write_batch(messages, touches, jobs, metrics, render_times)
+            except Exception as e:
+                if self._is_transient_error(e):
+                    self._requeue(messages, touches, jobs, metrics, render_times)
+                    raise
+                self._write_rows(messages, touches, jobs, metrics, render_times)
+            except BaseException:
+                self._requeue(messages, touches, jobs, metrics, render_times)
+                raise
+        if messages or touches:
+            self._bump_sessions_version()
+
+    def _write_rows(self, messages, touches, jobs, metrics, render_times):
+        # Jobs first, as in _write_batch, so metrics can refer to them
+        batches = (
+            [([], {}, [job], [], []) for job in jobs]
+            + [([message], {}, [], [], []) for message in messages]
+            + [([], {session_id: ts}, [], [], []) for session_id, ts in touches.items()]
+            + [([], {}, [], [row], []) for row in metrics]
+            + [([], {}, [], [], [row]) for row in render_times]
+        )
+        for i, batch in enumerate(batches):
+            try:
+                self._write_batch(*batch)
+            except Exception as e:
+                if not self._is_transient_error(e):
+                    logger.exception("Dropping a buffered write the database rejected: %r", batch)
+                    continue
+                rest = batches[i:]
+                self._requeue(
+                    [row for b in rest for row in b[0]],
+                    {session_id: ts for b in rest for session_id, ts in b[1].items()},
+                    [row for b in rest for row in b[2]],
+                    [row for b in rest for row in b[3]],
+                    [row for b in rest for row in b[4]],
+                )
+                raise
+
+    def _requeue(self, messages, touches, jobs, metrics, render_times):
+        # Put the batch back in front of anything queued meanwhile
+        with self._pending_lock:
+            self._pending_messages[:0] = messages
+            self._pending_jobs[:0] = jobs
+            self._pending_metrics[:0] = metrics
+            self._pending_render_times[:0] = render_times
+            for session_id, ts in touches.items():
+                self._pending_touches.setdefault(session_id, ts)
+
+    def _is_transient_error(self, error: Exception) -> bool:
+        """Whether a failed write is worth retrying as is (the database was
+        busy or unreachable) rather than caused by the rows themselves."""
+        return False
+
+    @abstractmethod
+    def _write_batch(self, messages, touches, jobs, metrics, render_times):
+        """Write one flushed batch in a single transaction.
+
+        ``messages`` are (session_id, role, content, timestamp, cached,
+        model_id, group_id) tuples, ``touches`` maps session_id to a UTC
+        'YYYY-MM-DD HH:MM:SS' activity time, ``jobs`` are (job_id,
+        session_id, prompt, model_id, assistant_ts, group_id, worker)
+        tuples, ``metrics`` are tuples in METRIC_COLUMNS order and
+        ``render_times`` are (render_ms, job_id) tuples.
+        """
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Background flush of session writes failed")
+
+    def close(self):
+        self.flush()
+        super().close()
+
+    # Buffered writes
+    def save_message(
+        self,
+        session_id: str,
+        role: str,
+        content: str,
+        timestamp: str,
+        cached: bool = False,
+        model_id: Optional[str] = None,
+        group_id: Optional[str] = None,
+    ):
+        self._enqueue(
+            messages=[(session_id, role, content, timestamp, int(cached), model_id, group_id)],
+            touches=[session_id]
+        )
+
+    def create_job(
+        self,
+        job_id: str,
+        session_id: str,
+        prompt: str,
+        model_id: str,
+        assistant_ts: str,
+        group_id: Optional[str] = None,
+    ):
+        self._enqueue(jobs=[(job_id, session_id, prompt, model_id, assistant_ts, group_id, self.worker_id)])
+
+    def save_query_metrics(self, metrics: dict):
+        """Queue one query_metrics row; ``stages`` is stored as JSON."""
+        row = dict(metrics, stages=json.dumps(metrics.get("stages", [])))
+        row.setdefault("created_at", time.time())
+        self._enqueue(metrics=[tuple(row.get(column) for column in METRIC_COLUMNS)])
+
+    def save_render_time(self, job_id: str, render_ms: float):
+        self._enqueue(render_times=[(render_ms, job_id)])
+
+    # Implemented by each backend
+    @abstractmethod
+    def save_session(self, session_id: str, session_name: str, owner: str = ANONYMOUS_OWNER):
+        ...
+
+    @abstractmethod
+    def is_archived(self, session_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    def list_sessions(self, limit: int, offset: int = 0, owner: Optional[str] = None) -> List[SessionInfo]:
+        ...
+
+    @abstractmethod
+    def search_sessions(self, text: str, limit: int, owner: Optional[str] = None) -> List[SessionInfo]:
+        ...
+
+    @abstractmethod
+    def get_all_sessions(self, owner: Optional[str] = None) -> List[SessionInfo]:
+        ...
+
+    @abstractmethod
+    def delete_session(self, session_id: str, owner: Optional[str] = None) -> bool:
+        ...
+
+    @abstractmethod
+    def load_session_messages(
+        self, session_id: str, limit: int = None, before_id: int = None, owner: Optional[str] = None
+    ) -> List[Message]:
+        ...
+
+    @abstractmethod
+    def clear_session_messages(self, session_id: str, owner: Optional[str] = None):
+        ...
+
+    @abstractmethod
+    def finish_job(
+        self, job_id, session_id, status, content, assistant_ts, result: Optional[ResultBlob] = None
+    ) -> bool:
+        ...
+
+    @abstractmethod
+    def load_result(self, result_id: str) -> Optional[ResultBlob]:
+        ...
+
+    @abstractmethod
+    def fail_active_jobs(self, status: str, content: str, stale_before: Optional[str] = None, own: bool = True):
+        ...
+
+    @abstractmethod
+    def load_query_metrics(self, since: float = None, limit: int = 5000) -> List[dict]:
+        ...
+
+    # Maintenance (see maintenance.py)
+    @abstractmethod
+    def sessions_to_archive(self, idle_before: str, keep_active: Optional[int] = None) -> List[str]:
+        ...
+
+    @abstractmethod
+    def sessions_to_delete(self, idle_before: str, keep: Optional[int] = None) -> List[str]:
+        ...
+
+    @abstractmethod
+    def archive_session(self, session_id: str, write: Callable[[dict, List[dict], List[dict]], None]) -> bool:
+        ...
+
+    @abstractmethod
+    def restore_session(self, session_id: str, messages: List[dict], results: List[dict]):
+        ...
+
+    @abstractmethod
+    def purge_history(self, jobs_before: str, metrics_before: float) -> Dict[str, int]:
+        ...
+
+
+class SessionStore(BaseSessionStore, SQLiteDatabase):
+    """SQLite session storage on a pool of shared connections (see
+    BaseSessionStore for the write-behind buffer)."""
+
+    def __init__(
+        self,
+        db_path: Path,
+        flush_interval: float = 0.5,
+        max_pending: int = 500,
+        worker_id: Optional[str] = None,
+        **kwargs
+    ):
+        BaseSessionStore.__init__(self, flush_interval, max_pending, worker_id)
+        SQLiteDatabase.__init__(self, db_path, **kwargs)
+        self._start_flusher()
+
+    def _write_batch(self, messages, touches, jobs, metrics, render_times):
+        with self.transaction() as conn:
+            conn.executemany(
+                """
+                INSERT INTO jobs (job_id, session_id, prompt, model_id, assistant_ts, group_id, worker, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'queued')
+                """,
+                jobs
+            )
+            conn.executemany(
+                """
+                INSERT INTO messages (session_id, role, content, timestamp, cached, model_id, group_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                messages
+            )
+            conn.executemany(
+                "UPDATE sessions SET last_activity = ? WHERE session_id = ?",
+                [(ts, session_id) for session_id, ts in touches.items()]
+            )
+            conn.executemany(
+                f"""
+                INSERT OR IGNORE INTO query_metrics ({", ".join(METRIC_COLUMNS)})
+                VALUES ({", ".join("?" for _ in METRIC_COLUMNS)})
+                """,
+                metrics
+            )
+            conn.executemany(
+                "UPDATE query_metrics SET render_ms = ? WHERE job_id = ?",
+                render_times
+            )
+
+    def _is_transient_error(self, error: Exception) -> bool:
+        return isinstance(error, sqlite3.OperationalError) and any(
+            word in str(error) for word in ("locked", "busy")
+        )
+
+    # Schema
+    def init_schema(self):
+        super().init_schema()
+        with self.connection() as conn:
+            migrate(conn)
+            self.has_search_index = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+            ).fetchone() is not None
+
+    # Sessions
+    def save_session(self, session_id: str, session_name: str, owner: str = ANONYMOUS_OWNER):
+        # An UPSERT rather than INSERT OR REPLACE: REPLACE deletes the row
+        # without firing delete triggers, which would corrupt the search index.
+        # Another owner's session is never updated.
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO sessions (session_id, session_name, owner, last_activity)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (session_id) DO UPDATE SET
+                    session_name = excluded.session_name,
+                    last_activity = excluded.last_activity
+                WHERE sessions.owner = excluded.owner
+                """,
+                (session_id, session_name, owner)
+            )
+        self._bump_sessions_version()
+
+    def is_archived(self, session_id: str) -> bool:
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT archived_at IS NOT NULL FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def list_sessions(self, limit: int, offset: int = 0, owner: Optional[str] = None):
+        where, params = _owner_filter(owner)
+        with self.connection() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT session_id, session_name, last_activity
+                FROM sessions {where}
+                ORDER BY last_activity DESC
+                LIMIT ? OFFSET ?
+                """,
+                (*params, limit, offset)
+            ).fetchall()
+        return [SessionInfo(*r) for r in rows]
+
+    def search_sessions(self, text: str, limit: int, owner: Optional[str] = None):
+        """Sessions whose name or any message matches ``text``, most recent first."""
+        if not text.split():
+            return self.list_sessions(limit, owner=owner)
+        scope = "AND owner = ?" if owner is not None else ""
+        if self.has_search_index:
+            match = fts_query(text)
+            query = f"""
+                SELECT session_id, session_name, last_activity FROM sessions
+                WHERE (rowid IN (SELECT rowid FROM sessions_fts WHERE sessions_fts MATCH ?)
+                   OR session_id IN (
+                       SELECT m.session_id FROM messages_fts f
+                       JOIN messages m ON m.id = f.rowid
+                       WHERE messages_fts MATCH ?
+                   )) {scope}
+                ORDER BY last_activity DESC
+                LIMIT ?
+            """
+        else:
+            match = "%" + text.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            query = f"""
+                SELECT session_id, session_name, last_activity FROM sessions s
+                WHERE (session_name LIKE ? ESCAPE '\\'
+                   OR EXISTS (
+                       SELECT 1 FROM messages m
+                       WHERE m.session_id = s.session_id AND m.content LIKE ? ESCAPE '\\'
+                   )) {scope}
+                ORDER BY last_activity DESC
+                LIMIT ?
+            """
+        params = (match, match) + ((owner,) if owner is not None else ()) + (limit,)
+        with self.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [SessionInfo(*r) for r in rows]
+
+    def get_all_sessions(self, owner: Optional[str] = None):
+        where, params = _owner_filter(owner)
+        with self.connection() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT session_id, session_name, last_activity
+                FROM sessions {where}
+                ORDER BY last_activity DESC
+                """,
+                params
+            ).fetchall()
+        return [SessionInfo(*r) for r in rows]
+
+    def _owns(self, conn, session_id: str, owner: Optional[str]) -> bool:
+        if owner is None:
+            return True
+        return conn.execute(
+            "SELECT 1 FROM sessions WHERE session_id = ? AND owner = ?", (session_id, owner)
+        ).fetchone() is not None
+
+    def delete_session(self, session_id: str, owner: Optional[str] = None) -> bool:
+        """Delete a session and everything in it; False if ``owner`` does not own it."""
+        self.flush()
+        with self.transaction() as conn:
+            if not self._owns(conn, session_id, owner):
+                return False
+            conn.execute('DELETE FROM results WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+        try:
+            self.reclaim_space(DELETE_VACUUM_PAGES)
+        except sqlite3.OperationalError:
+            # Busy writers; the pages stay on the freelist until the next run
+            logger.debug("Skipped space reclamation after deleting %s", session_id)
+        self._bump_sessions_version()
+        return True
+
+    # Messages
+    def load_session_messages(
+        self, session_id: str, limit: int = None, before_id: int = None, owner: Optional[str] = None
+    ):
+        """Return messages oldest-first; with ``limit``, only the newest ``limit``
+        messages older than ``before_id`` (keyset pagination on ``id``).
+        Answers from a job carry its total latency in ``latency_ms``."""
+        query = """
+            SELECT m.id, m.role, m.content, m.timestamp, m.cached, m.result_id,
+                   m.model_id, m.group_id, q.total_ms
+            FROM messages m LEFT JOIN query_metrics q ON q.job_id = m.job_id
+            WHERE m.session_id = ?
+        """
+        params = [session_id]
+        if owner is not None:
+            query += " AND EXISTS (SELECT 1 FROM sessions s WHERE s.session_id = m.session_id AND s.owner = ?)"
+            params.append(owner)
+        if before_id is not None:
+            query += " AND m.id < ?"
+            params.append(before_id)
+        if limit is None:
+            query += " ORDER BY m.id ASC"
+        else:
+            query += " ORDER BY m.id DESC LIMIT ?"
+            params.append(limit)
+        # Also waits for a batch the background flusher is still writing
+        self.flush()
+        with self.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        if limit is not None:
+            rows.reverse()
+        return [
+            Message(
+                role=r[1], content=r[2], timestamp=r[3], id=r[0], cached=bool(r[4]),
+                result_id=r[5], model_id=r[6], group_id=r[7], latency_ms=r[8],
+            )
+            for r in rows
+        ]
+
+    def clear_session_messages(self, session_id: str, owner: Optional[str] = None):
+        self.flush()
+        with self.transaction() as conn:
+            if not self._owns(conn, session_id, owner):
+                return
+            conn.execute('DELETE FROM results WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+
+    # Jobs
+    def finish_job(
+        self,
+        job_id: str,
+        session_id: str,
+        status: str,
+        content: str,
+        assistant_ts: str,
+        result: Optional[ResultBlob] = None,
+    ) -> bool:
+        """Store the assistant answer (and its result set) and close the job in
+        one transaction. Does nothing if the job was already closed, e.g.
+        failed as lost by another process; returns whether it was stored."""
+        # Flush first so the answer is ordered after the buffered question
+        self.flush()
+        with self.transaction() as conn:
+            if not self._finish_job(conn, job_id, session_id, status, content, assistant_ts, result):
+                return False
+        self._bump_sessions_version()
+        return True
+
+    def load_result(self, result_id: str) -> Optional[ResultBlob]:
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT result_id, format, num_rows, payload FROM results WHERE result_id = ?",
+                (result_id,)
+            ).fetchone()
+        return ResultBlob(*row) if row is not None else None
+
+    def fail_active_jobs(self, status: str, content: str, stale_before: Optional[str] = None, own: bool = True):
+        """Finish jobs left queued or running by a previous process: with
+        ``own``, this worker's (and untagged ones from before jobs had a
+        worker), plus any worker's created before ``stale_before``, since a
+        replica that went away may never come back under the same name."""
+        with self.transaction() as conn:
+            rows = conn.execute(
+                """
+                SELECT job_id, session_id, assistant_ts FROM jobs
+                WHERE status IN ('queued', 'running')
+                  AND ((? AND (worker = ? OR worker IS NULL)) OR created_at < ?)
+                """,
+                (own, self.worker_id, stale_before)
+            ).fetchall()
+            for job_id, session_id, assistant_ts in rows:
+                self._finish_job(conn, job_id, session_id, status, content, assistant_ts)
+
+    def _finish_job(self, conn, job_id, session_id, status, content, assistant_ts, result=None) -> bool:
+        # Only an active job gets an answer, so a job closed twice (by its
+        # worker and by a sweep for lost jobs) never gets two
+        closed = conn.execute(
+            """
+            UPDATE jobs SET status = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE job_id = ? AND status IN ('queued', 'running')
+            """,
+            (status, job_id)
+        ).rowcount
+        if not closed:
+            return False
+        if result is not None:
+            conn.execute(
+                """
+                INSERT INTO results (result_id, session_id, format, num_rows, payload)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (result.result_id, session_id, result.format, result.num_rows, result.payload)
+            )
+        conn.execute(
+            """
+            INSERT INTO messages (session_id, role, content, timestamp, result_id, model_id, group_id, job_id)
+            SELECT ?, 'assistant', ?, ?, ?, model_id, group_id, job_id FROM jobs WHERE job_id = ?
+            """,
+            (session_id, content, assistant_ts, result.result_id if result is not None else None, job_id)
+        )
+        conn.execute(
+            """
+            UPDATE sessions SET last_activity = CURRENT_TIMESTAMP
+            WHERE session_id = ?
+            """,
+            (session_id,)
+        )
+        return True
+
+    # Metrics
+    def load_query_metrics(self, since: float = None, limit: int = 5000):
+        query = f"SELECT {', '.join(METRIC_COLUMNS)} FROM query_metrics"
+        params = []
+        if since is not None:
+            query += " WHERE created_at >= ?"
+            params.append(since)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        metrics = [dict(zip(METRIC_COLUMNS, row)) for row in rows]
+        for row in metrics:
+            row["stages"] = json.loads(row["stages"])
+        return metrics
+
+    # Retention and archival
+    def sessions_to_archive(self, idle_before: str, keep_active: Optional[int] = None) -> List[str]:
+        """Unarchived sessions idle since before ``idle_before`` (UTC
+        'YYYY-MM-DD HH:MM:SS'), plus any beyond each owner's ``keep_active``
+        most recent ones. Sessions with a query in flight are never picked."""
+        return self._select_session_ids(RETENTION_QUERY.format(where="WHERE archived_at IS NULL"), idle_before, keep_active)
+
+    def sessions_to_delete(self, idle_before: str, keep: Optional[int] = None) -> List[str]:
+        """Sessions, archived or not, idle since before ``idle_before`` or
+        beyond each owner's ``keep`` most recent ones."""
+        return self._select_session_ids(RETENTION_QUERY.format(where=""), idle_before, keep)
+
+    def _select_session_ids(self, query: str, idle_before: str, keep: Optional[int]) -> List[str]:
+        self.flush()
+        with self.connection() as conn:
+            rows = conn.execute(query, (idle_before, keep)).fetchall()
+        return [r[0] for r in rows]
+
+    def archive_session(self, session_id: str, write: Callable[[dict, List[dict], List[dict]], None]) -> bool:
+        """Move a session's messages and results out of the database.
+
+        ``write(session, messages, results)`` gets every row as a dict and
+        must persist them before returning; the rows are deleted only after
+        it has, under a write lock held throughout, so nothing written to the
+        session meanwhile can be lost. Returns False if there was nothing to
+        archive.
+        """
+        self.flush()
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                session = _fetch_dicts(
+                    conn, "SELECT * FROM sessions WHERE session_id = ? AND archived_at IS NULL", (session_id,)
+                )
+                if not session:
+                    conn.rollback()
+                    return False
+                messages = _fetch_dicts(conn, "SELECT * FROM messages WHERE session_id = ? ORDER BY id", (session_id,))
+                results = _fetch_dicts(conn, "SELECT * FROM results WHERE session_id = ?", (session_id,))
+                write(session[0], messages, results)
+                conn.execute("DELETE FROM results WHERE session_id = ?", (session_id,))
+                conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                conn.execute(
+                    "UPDATE sessions SET archived_at = CURRENT_TIMESTAMP WHERE session_id = ?", (session_id,)
+                )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return True
+
+    def restore_session(self, session_id: str, messages: List[dict], results: List[dict]):
+        """Put archived rows back, keeping their original ids (and so their
+        order), and clear the archived flag."""
+        with self.transaction() as conn:
+            for table, rows in (("messages", messages), ("results", results)):
+                columns = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+                for row in rows:
+                    row = {key: value for key, value in row.items() if key in columns}
+                    row["session_id"] = session_id
+                    conn.execute(
+                        f"INSERT OR IGNORE INTO {table} ({', '.join(row)}) VALUES ({', '.join('?' for _ in row)})",
+                        tuple(row.values())
+                    )
+            conn.execute("UPDATE sessions SET archived_at = NULL WHERE session_id = ?", (session_id,))
+
+    def purge_history(self, jobs_before: str, metrics_before: float) -> Dict[str, int]:
+        """Drop finished jobs older than ``jobs_before`` (UTC timestamp text)
+        and query metrics older than ``metrics_before`` (epoch seconds)."""
+        self.flush()
+        with self.transaction() as conn:
+            jobs = conn.execute(
+                "DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND finished_at < ?",
+                (jobs_before,)
+            ).rowcount
+            metrics = conn.execute("DELETE FROM query_metrics WHERE created_at < ?", (metrics_before,)).rowcount
+        return {"jobs": jobs, "metrics": metrics}
+
+
+def _owner_filter(owner: Optional[str]):
+    return ("WHERE owner = ?", (owner,)) if owner is not None else ("", ())
+
+
+def _fetch_dicts(conn: sqlite3.Connection, query: str, params=()) -> List[dict]:
+    cursor = conn.execute(query, params)
+    columns = [d[0] for d in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def open_session_store(location, **kwargs) -> BaseSessionStore:
+    """A PostgreSQL store for a postgres:// or postgresql:// URL, otherwise
+    a SQLite store for the database file at ``location``."""
+    if str(location).startswith(("postgres://", "postgresql://")):
+        from pg_storage import PostgresSessionStore  # needs psycopg and psycopg_pool
+        return PostgresSessionStore(str(location), **kwargs)
+    return SessionStore(Path(location), **kwargs)
@@ -0,0 +1,183 @@
+"""PostgresSessionStore against a real server.
+
+Uses the database named by BIPP_TEST_DATABASE_URL, or else a throwaway
+server started with the pgserver package; skipped when neither is available.
+Each test gets a database of its own.
+
+    BIPP_TEST_DATABASE_URL=postgresql://bipp@localhost/postgres python -m pytest tests
+"""
+import os
+import time
+import uuid
+
+import pytest
+
+psycopg = pytest.importorskip("psycopg")
+pytest.importorskip("psycopg_pool")
+
+from psycopg.conninfo import conninfo_to_dict, make_conninfo  # noqa: E402
+
+import maintenance  # noqa: E402
+import pg_storage  # noqa: E402
+from storage import ResultBlob  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def server_url(tmp_path_factory):
+    url = os.environ.get("BIPP_TEST_DATABASE_URL")
+    if url:
+        yield url
+        return
+    pgserver = pytest.importorskip("pgserver", reason="set BIPP_TEST_DATABASE_URL or install pgserver")
+    server = pgserver.get_server(tmp_path_factory.mktemp("pgdata"), cleanup_mode="stop")
+    try:
+        yield server.get_uri()
+    finally:
+        server.cleanup()
+
+
+@pytest.fixture
+def database_url(server_url):
+    name = f"bipp_test_{uuid.uuid4().hex[:12]}"
+    with psycopg.connect(server_url, autocommit=True) as conn:
+        conn.execute(f"CREATE DATABASE {name}")
+    yield make_conninfo(**{**conninfo_to_dict(server_url), "dbname": name})
+    with psycopg.connect(server_url, autocommit=True) as conn:
+        conn.execute(f"DROP DATABASE {name} WITH (FORCE)")
+
+
+@pytest.fixture
+def store(database_url):
+    store = pg_storage.PostgresSessionStore(database_url, worker_id="pod-a", pool_size=2)
+    yield store
+    store.close()
+
+
+def test_migrate_is_idempotent(store):
+    with store.connection() as conn:
+        assert pg_storage.migrate(conn) == pg_storage.SCHEMA_VERSION
+        assert conn.execute("SELECT version FROM schema_version").fetchall() == [(pg_storage.SCHEMA_VERSION,)]
+
+
+def test_upsert_keeps_session_with_its_owner(store):
+    store.save_session("s1", "Vendas da Ana", "ana")
+    store.save_session("s1", "Renomeada", "ana")
+    store.save_session("s1", "Tomada", "bruno")
+    store.save_message("s1", "user", "faturamento", "10:00")
+
+    assert [s.session_name for s in store.list_sessions(10, owner="ana")] == ["Renomeada"]
+    assert store.list_sessions(10, owner="bruno") == []
+    assert store.load_session_messages("s1", owner="bruno") == []
+    assert not store.delete_session("s1", owner="bruno")
+    assert [m.content for m in store.load_session_messages("s1", owner="ana")] == ["faturamento"]
+    assert store.delete_session("s1", owner="ana")
+    assert store.get_all_sessions() == []
+
+
+def test_search_matches_names_and_messages_per_owner(store):
+    store.save_session("a1", "Vendas da Ana", "ana")
+    store.save_session("b1", "Estoque", "bruno")
+    store.save_message("b1", "user", "faturamento por região", "10:00")
+    store.flush()
+
+    assert [s.session_id for s in store.search_sessions("vend", 10, owner="ana")] == ["a1"]
+    assert [s.session_id for s in store.search_sessions("fatur regi", 10, owner="bruno")] == ["b1"]
+    assert store.search_sessions("fatur", 10, owner="ana") == []
+    # Operators in the search text are terms, not tsquery syntax
+    assert [s.session_id for s in store.search_sessions("fatur & !", 10)] == ["b1"]
+
+
+def test_archive_and_restore_round_trip(store):
+    store.save_session("s1", "Vendas", "ana")
+    store.save_message("s1", "user", "tabela de vendas", "10:00")
+    store.create_job("j1", "s1", "tabela de vendas", "m", "10:01")
+    store.finish_job("j1", "s1", "completed", "Aqui está", "10:01", ResultBlob("r1", "parquet", 2, b"\x00data"))
+
+    archived = []
+    assert store.archive_session("s1", lambda *rows: archived.append(rows))
+    session, messages, results = archived[0]
+    assert session["session_id"] == "s1" and isinstance(session["last_activity"], str)
+    assert [m["content"] for m in messages] == ["tabela de vendas", "Aqui está"]
+    assert results[0]["payload"] == b"\x00data"
+    assert store.is_archived("s1")
+    assert store.load_session_messages("s1") == []
+    assert not store.archive_session("s1", lambda *rows: None)
+
+    store.restore_session("s1", messages, results)
+    assert not store.is_archived("s1")
+    restored = store.load_session_messages("s1", owner="ana")
+    assert [(m.id, m.content) for m in restored] == [(m["id"], m["content"]) for m in messages]
+    assert store.load_result(restored[-1].result_id).payload == b"\x00data"
+
+
+def test_retention_selects_by_age_and_rank(store):
+    for i in range(3):
+        store.save_session(f"s{i}", "x", "ana")
+    store.save_session("b0", "x", "bruno")
+    with store.transaction() as conn:
+        conn.execute("UPDATE sessions SET last_activity = last_activity - interval '10 days' WHERE session_id = 's0'")
+        conn.execute("UPDATE sessions SET last_activity = last_activity - interval '2 hours' WHERE session_id = 's1'")
+
+    cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - 86400))
+    # keep=None binds a NULL to COALESCE: age alone decides
+    assert store.sessions_to_archive(cutoff) == ["s0"]
+    # Ranked per owner: each keeps its most recent session
+    assert sorted(store.sessions_to_delete("0001-01-01 00:00:00", 1)) == ["s0", "s1"]
+    assert store.archive_session("s0", lambda *rows: None)
+    assert store.sessions_to_archive(cutoff) == []
+
+
+def test_fail_active_jobs_reaches_stale_jobs_of_other_workers(store, database_url):
+    store.save_session("s1", "x")
+    store.create_job("old", "s1", "q", "m", "10:00")
+    store.create_job("young", "s1", "q", "m", "10:01")
+    store.flush()
+    with store.transaction() as conn:
+        conn.execute("UPDATE jobs SET created_at = created_at - interval '1 hour' WHERE job_id = 'old'")
+
+    other = pg_storage.PostgresSessionStore(database_url, worker_id="pod-b", pool_size=1)
+    try:
+        stale_before = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - 600))
+        other.fail_active_jobs("interrupted", "interrompida", stale_before)
+    finally:
+        other.close()
+    with store.connection() as conn:
+        statuses = dict(conn.execute("SELECT job_id, status FROM jobs").fetchall())
+    assert statuses == {"old": "interrupted", "young": "queued"}
+    assert [m.content for m in store.load_session_messages("s1")] == ["interrompida"]
+
+
+def test_rejected_row_is_dropped_without_blocking_later_writes(store):
+    store.save_session("s1", "x")
+    store.save_message("s1", "user", "nul \x00 byte", "10:00")
+    store.save_message("s1", "user", "ok", "10:01")
+    store.flush()
+    assert not store.has_pending_writes
+    assert [m.content for m in store.load_session_messages("s1")] == ["ok"]
+    assert store.delete_session("s1")
+
+
+def test_job_closed_as_lost_gets_no_second_answer(store):
+    store.save_session("s1", "x")
+    store.create_job("j1", "s1", "q", "m", "10:00")
+    store.flush()
+    store.fail_active_jobs("interrupted", "interrompida")
+    assert not store.finish_job("j1", "s1", "completed", "real answer", "10:00", ResultBlob("r1", "parquet", 1, b"x"))
+    assert [m.content for m in store.load_session_messages("s1")] == ["interrompida"]
+    assert store.load_result("r1") is None
+
+
+def test_archive_is_restored_by_another_replica(store, database_url, tmp_path):
+    store.save_session("s1", "Vendas", "ana")
+    store.save_message("s1", "user", "tabela de vendas", "10:00")
+    assert maintenance.archive_session(store, maintenance.open_archive(store, tmp_path / "a"), "s1")
+
+    other = pg_storage.PostgresSessionStore(database_url, worker_id="pod-b", pool_size=1)
+    try:
+        archive = maintenance.open_archive(other, tmp_path / "b")
+        assert maintenance.rehydrate_session(other, archive, "s1")
+        assert [m.content for m in other.load_session_messages("s1")] == ["tabela de vendas"]
+        assert other.load_archive("s1") is None
+    finally:
+        other.close()
+    assert not (tmp_path / "a").exists()
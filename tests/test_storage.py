@@ -0,0 +1,163 @@
+"""SessionStore (SQLite), the default backend; tests/test_pg_storage.py
+covers the same ground for PostgreSQL."""
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import storage
+from storage import ResultBlob, SessionStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SessionStore(tmp_path / "sessions.db", worker_id="pod-a")
+    yield store
+    store.close()
+
+
+def test_migrate_is_idempotent(store):
+    with store.connection() as conn:
+        assert storage.migrate(conn) == storage.SCHEMA_VERSION
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == storage.SCHEMA_VERSION
+
+
+def test_upsert_keeps_session_with_its_owner(store):
+    store.save_session("s1", "Vendas da Ana", "ana")
+    store.save_session("s1", "Renomeada", "ana")
+    store.save_session("s1", "Tomada", "bruno")
+    store.save_message("s1", "user", "faturamento", "10:00")
+
+    assert [s.session_name for s in store.list_sessions(10, owner="ana")] == ["Renomeada"]
+    assert store.list_sessions(10, owner="bruno") == []
+    assert store.load_session_messages("s1", owner="bruno") == []
+    assert not store.delete_session("s1", owner="bruno")
+    assert [m.content for m in store.load_session_messages("s1", owner="ana")] == ["faturamento"]
+    assert store.delete_session("s1", owner="ana")
+    assert store.get_all_sessions() == []
+
+
+def test_search_matches_names_and_messages_per_owner(store):
+    store.save_session("a1", "Vendas da Ana", "ana")
+    store.save_session("b1", "Estoque", "bruno")
+    store.save_message("b1", "user", "faturamento por região", "10:00")
+    store.flush()
+
+    assert [s.session_id for s in store.search_sessions("vend", 10, owner="ana")] == ["a1"]
+    assert [s.session_id for s in store.search_sessions("fatur regi", 10, owner="bruno")] == ["b1"]
+    assert store.search_sessions("fatur", 10, owner="ana") == []
+    # FTS5 query syntax in the search text is not interpreted
+    assert [s.session_id for s in store.search_sessions('fatur "', 10)] == ["b1"]
+
+
+def test_archive_and_restore_round_trip(store):
+    store.save_session("s1", "Vendas", "ana")
+    store.save_message("s1", "user", "tabela de vendas", "10:00")
+    store.create_job("j1", "s1", "tabela de vendas", "m", "10:01")
+    store.finish_job("j1", "s1", "completed", "Aqui está", "10:01", ResultBlob("r1", "parquet", 2, b"\x00data"))
+
+    archived = []
+    assert store.archive_session("s1", lambda *rows: archived.append(rows))
+    session, messages, results = archived[0]
+    assert session["session_id"] == "s1"
+    assert [m["content"] for m in messages] == ["tabela de vendas", "Aqui está"]
+    assert results[0]["payload"] == b"\x00data"
+    assert store.is_archived("s1")
+    assert store.load_session_messages("s1") == []
+    assert not store.archive_session("s1", lambda *rows: None)
+
+    store.restore_session("s1", messages, results)
+    assert not store.is_archived("s1")
+    restored = store.load_session_messages("s1", owner="ana")
+    assert [(m.id, m.content) for m in restored] == [(m["id"], m["content"]) for m in messages]
+    assert store.load_result(restored[-1].result_id).payload == b"\x00data"
+
+
+def test_retention_selects_by_age_and_rank(store):
+    for i in range(3):
+        store.save_session(f"s{i}", "x", "ana")
+    store.save_session("b0", "x", "bruno")
+    with store.transaction() as conn:
+        conn.execute("UPDATE sessions SET last_activity = datetime(last_activity, '-10 days') WHERE session_id = 's0'")
+        conn.execute("UPDATE sessions SET last_activity = datetime(last_activity, '-2 hours') WHERE session_id = 's1'")
+
+    cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - 86400))
+    assert store.sessions_to_archive(cutoff) == ["s0"]
+    # Ranked per owner: each keeps its most recent session
+    assert sorted(store.sessions_to_delete("0001-01-01 00:00:00", 1)) == ["s0", "s1"]
+    assert store.archive_session("s0", lambda *rows: None)
+    assert store.sessions_to_archive(cutoff) == []
+
+
+def test_fail_active_jobs_reaches_stale_jobs_of_other_workers(store, tmp_path):
+    store.save_session("s1", "x")
+    store.create_job("old", "s1", "q", "m", "10:00")
+    store.create_job("young", "s1", "q", "m", "10:01")
+    store.flush()
+    with store.transaction() as conn:
+        conn.execute("UPDATE jobs SET created_at = datetime(created_at, '-1 hour') WHERE job_id = 'old'")
+
+    other = SessionStore(tmp_path / "sessions.db", worker_id="pod-b")
+    try:
+        stale_before = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - 600))
+        other.fail_active_jobs("interrupted", "interrompida", stale_before)
+    finally:
+        other.close()
+    with store.connection() as conn:
+        statuses = dict(conn.execute("SELECT job_id, status FROM jobs").fetchall())
+    assert statuses == {"old": "interrupted", "young": "queued"}
+    assert [m.content for m in store.load_session_messages("s1")] == ["interrompida"]
+
+
+def test_rejected_row_is_dropped_without_blocking_later_writes(store):
+    store.save_session("s1", "x")
+    store.save_message("s1", "user", None, "10:00")
+    store.save_message("s1", "user", "ok", "10:01")
+    store.flush()
+    assert not store.has_pending_writes
+    assert [m.content for m in store.load_session_messages("s1")] == ["ok"]
+    assert store.delete_session("s1")
+
+
+def test_busy_pool_keeps_the_batch_queued(tmp_path):
+    store = SessionStore(tmp_path / "sessions.db", pool_size=1, busy_timeout=0.1)
+    try:
+        store.save_session("s1", "x")
+        store.save_message("s1", "user", "hello", "10:00")
+        with store.connection():
+            with pytest.raises(sqlite3.OperationalError):
+                store.flush()
+            assert store.has_pending_writes
+        assert [m.content for m in store.load_session_messages("s1")] == ["hello"]
+    finally:
+        store.close()
+
+
+def test_read_waits_for_a_batch_being_flushed(store):
+    store.save_session("s1", "x")
+    write_batch = store._write_batch
+    writing = threading.Event()
+
+    def slow_write_batch(*batch):
+        writing.set()
+        time.sleep(0.3)
+        write_batch(*batch)
+
+    store._write_batch = slow_write_batch
+    store.save_message("s1", "user", "hello", "10:00")
+    flusher = threading.Thread(target=store.flush)
+    flusher.start()
+    writing.wait(1)
+    assert [m.content for m in store.load_session_messages("s1")] == ["hello"]
+    flusher.join()
+
+
+def test_job_closed_as_lost_gets_no_second_answer(store):
+    store.save_session("s1", "x")
+    store.create_job("j1", "s1", "q", "m", "10:00")
+    store.flush()
+    store.fail_active_jobs("interrupted", "interrompida")
+    assert not store.finish_job("j1", "s1", "completed", "real answer", "10:00", ResultBlob("r1", "parquet", 1, b"x"))
+    assert [m.content for m in store.load_session_messages("s1")] == ["interrompida"]
+    assert store.load_result("r1") is None
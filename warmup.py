@@ -0,0 +1,91 @@
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupScheduler:
+    """Debounced, fire-and-forget background requests, one pending per key.
+
+    ``schedule(key, payload)`` sends ``payload`` through ``send(key, payload)``
+    on a worker thread once ``debounce`` seconds pass without another
+    schedule for the same key, so a burst of triggers (switching through
+    sessions, scrolling the model list) costs one request. A payload equal
+    to the last one sent for its key within ``ttl`` seconds is dropped.
+    Failures are logged and otherwise ignored.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Hashable, object], None],
+        debounce: float = 0.5,
+        ttl: float = 300,
+        max_workers: int = 2,
+        max_keys: int = 10_000,
+    ):
+        self._send = send
+        self.debounce = debounce
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._pending: Dict[Hashable, Tuple[float, object]] = {}
+        self._sent: Dict[Hashable, Tuple[float, object]] = {}
+        self._heap = []
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bipp-warmup")
+        self.sent = 0
+        self.skipped = 0
+        threading.Thread(target=self._run, name="bipp-warmup-scheduler", daemon=True).start()
+
+    def schedule(self, key: Hashable, payload: object, delay: Optional[float] = None):
+        due = time.monotonic() + (self.debounce if delay is None else delay)
+        with self._cond:
+            self._pending[key] = (due, payload)
+            heapq.heappush(self._heap, (due, id(payload), key))
+            self._cond.notify()
+
+    def cancel(self, key: Hashable):
+        """Drop a warm-up for ``key`` that has not been sent yet."""
+        with self._cond:
+            self._pending.pop(key, None)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due, _, key = self._heap[0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+                entry = self._pending.get(key)
+                # Superseded by a later schedule(); its own heap entry fires it
+                if entry is None or entry[0] != due:
+                    continue
+                del self._pending[key]
+                payload = entry[1]
+                last = self._sent.get(key)
+                if last is not None and last[1] == payload and now - last[0] < self.ttl:
+                    self.skipped += 1
+                    continue
+                self._sent.pop(key, None)
+                self._sent[key] = (now, payload)
+                while len(self._sent) > self.max_keys:
+                    del self._sent[next(iter(self._sent))]
+                self.sent += 1
+            try:
+                self._executor.submit(self._call, key, payload)
+            except RuntimeError:
+                # The interpreter is shutting down
+                return
+
+    def _call(self, key: Hashable, payload: object):
+        try:
+            self._send(key, payload)
+        except Exception:
+            logger.debug("Warm-up for %s failed", key, exc_info=True)